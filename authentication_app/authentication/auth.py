@@ -1,240 +1,393 @@
 # my_authentication_app/authentication/auth.py
 from datetime import datetime, timedelta
+import asyncio
+import hashlib
+import logging
+import secrets
+import uuid
 import jwt
 from jwt import ExpiredSignatureError, PyJWTError
-from passlib.context import CryptContext
 from fastapi import Request, HTTPException, Depends, Security, status
-from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from pymongo.collection import Collection
-from pymongo.database import Database
+from fastapi.concurrency import contextmanager_in_threadpool
+from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm, SecurityScopes
 from pydantic import BaseModel
 
 from .config import NoSQLUserDB, User, UserForm
-from .postgresql_models import (SQLUserDB, 
-                                update_pg_user_session, 
-                                get_pg_user_session)
-from .mongodb_models import (create_user,
-                             find_user, 
-                            update_mongo_user)
+from .hashing import PasswordHasher
+from .keys import KeyRing
+from .permissions import RoleScopes, parse_scope_claim
+from .rate_limit import LoginRateLimiter
+from .session_cache import SessionCache
+from .session_store import SessionStore, get_session_store
+from .stores import UserStore, get_user_store
+from .sweeper import SessionSweeper
 
 from .database import Database
 
+logger = logging.getLogger(__name__)
+
 # OAuth2PasswordBearer for token authentication
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
+# for routes open to anonymous callers that allow more with a token, e.g. /signup
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login", auto_error=False)
+
 
+def hash_refresh_token(token: str) -> str:
+    # refresh tokens are random, a fast digest is enough to keep them out of the DB
+    return hashlib.sha256(token.encode()).hexdigest()
 
-# Password hashing
-passlib_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+def not_enough_permissions(scopes):
+    return HTTPException(
+        status_code=403, detail="Not enough permissions",
+        headers={"WWW-Authenticate": f'Bearer scope="{" ".join(scopes)}"'})
 
 # Authentication class
 class Auth:
-    def __init__(self, db: Database):
+    def __init__(self, db: Database, store: UserStore = None, hasher: PasswordHasher = None,
+                 session_cache: SessionCache = None, sessions: SessionStore = None,
+                 keys: KeyRing = None, rate_limiter: LoginRateLimiter = None,
+                 roles: RoleScopes = None, dummy_hash: str = None):
         self.db = db
+        # sync drivers run in the threadpool, async drivers are awaited directly
+        self.store = store or get_user_store(db)
+        # schemes and costs come from the config, see `build_crypt_context`
+        self.hasher = hasher or PasswordHasher.from_config(db.config)
+        self.session_cache = session_cache or SessionCache.from_config(db.config)
+        # revocations/activations from other workers land in the local cache
+        self.sessions = sessions or get_session_store(db.config)
+        self.sessions.subscribe(self._on_session_event)
+        self.keys = keys or KeyRing.from_config(db.config)
+        self.metrics = db.metrics
+        self.rate_limiter = rate_limiter or LoginRateLimiter.from_config(db.config)
+        self.roles = roles or RoleScopes.from_config(db.config)
+        # expires sessions in the background, started and stopped with the app
+        self.sweeper = SessionSweeper.from_config(self)
+        self._dummy_hash = dummy_hash
+        self._background_tasks = set()
 
-    def authenticate_user(self, form_data):
-        user = None
-        if self.db.config.use_database == "mongodb":
-            user = find_user({"username": form_data.username})
-            user_hash_password = user['hashed_password']
-            session_id = user['session_id']
+    def _on_session_event(self, event):
+        if event["type"] == "revoke":
+            self.session_cache.revoke_user(event["username"])
+        else:
+            self.session_cache.invalidate_user(event["username"])
 
-        elif self.db.config.use_database == "postgresql":
-            user = get_pg_user_session(self.db, username=form_data.username)
-            user_hash_password = str(user.hashed_password).strip()
-            session_id = user.session_id
+    async def authenticate_user(self, form_data):
+        with self.metrics.stage("authenticate_user"):
+            user = await self.store.get_user(form_data.username)
 
-        # print(user)
-        if not user:
-            return False
-        # print("user", user.username, "Length: ", len(user.hashed_password), "type", type(user))
-        # print("Input hashed pass: ", len(self.get_password_hash(form_data.password)))
+            if not user:
+                # pay for a verify anyway so unknown usernames don't answer faster
+                await self.verify_password(form_data.password, await self.get_dummy_hash())
+                return False
 
-        if not self.verify_password(form_data.password, user_hash_password):
-            return False
+            valid, new_hash = await self.verify_and_update_password(
+                form_data.password, str(user['hashed_password']).strip())
+            if not valid:
+                return False
+            if new_hash:
+                # outdated scheme or cost, upgrade without holding up the login
+                self._spawn(self._upgrade_password_hash(
+                    user['username'], user['hashed_password'], new_hash))
+
+            return user
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def _upgrade_password_hash(self, username, old_hash, new_hash):
+        try:
+            await self.store.update_password_hash(username, old_hash, new_hash)
+        except Exception:
+            logger.exception("Could not upgrade the password hash of %s", username)
+
+    async def wait_background_tasks(self):
+        if self._background_tasks:
+            await asyncio.gather(*self._background_tasks, return_exceptions=True)
+
+    async def get_dummy_hash(self):
+        if self._dummy_hash is None:
+            self._dummy_hash = await self.hasher.hash(secrets.token_urlsafe(16))
+        return self._dummy_hash
+
+    async def login(self, form_data, client_ip: str = None):
+        # Throttled attempts are turned away before any DB lookup or hash
+        retry_after = await self.rate_limiter.hit(form_data.username, client_ip)
+        if retry_after:
+            raise HTTPException(
+                status_code=429, detail="Too many login attempts! Try again later",
+                headers={"Retry-After": str(retry_after)})
 
-        return user
-    
-    # When a user signs in or accesses a protected endpoint
-    def check_session_status(self, username):
-        # Query the user's session status in the database
-        if self.db.config.use_database == "postgresql":
-            user_session = get_pg_user_session(self.db, username)
-            if user_session and user_session.status == "active":
-                return True
-        elif self.db.config.use_database == "mongodb":
-            collection = self.db.get_session().users
-            user_session = collection.find_one({"username": username, "status": "active"})
-            if user_session:
-                return True
-
-
-
-    def login(self, form_data):
         # Authenticate user
-        user = self.authenticate_user(form_data)
-        print("Auth user: ", user.username)
+        user = await self.authenticate_user(form_data)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Incorrect username or password",
                 headers={"WWW-Authenticate": "Bearer"},
             )
-        
-        # prohibit multi user login on same 
-        username = form_data.username
-        if self.check_session_status(username):
+        logger.debug("Authenticated user: %s", user['username'])
+
+        # prohibit multi user login on same account: the session is activated
+        # with one conditional write that fails if another session is active
+        username = user['username']
+        role = self.roles.role_of(user)
+        await self.rate_limiter.reset(username)
+        session_id = uuid.uuid4().hex
+        # the refresh token is stored first, so an active session always has
+        # one and the sweeper can end those that don't. The user's expired
+        # tokens are dropped in the same write.
+        refresh_token = await self.issue_refresh_token(
+            username, session_id, prune_before=datetime.utcnow(), role=role)
+        if not await self.store.activate_session(username, session_id):
+            await self.store.delete_refresh_tokens(username, family_id=session_id)
             raise HTTPException(
                 status_code=409, detail="User active in another session!")
-        
+        await self._session_started(
+            username, session_id,
+            User(username=username, is_superuser=user['is_superuser'], role=role))
+
         access_token_expires = timedelta(
             minutes=self.db.config.access_token_expire_minutes)
-
-        if self.db.config.use_database == "postgresql":
-            username = user.username
-        elif self.db.config.use_database == "mongodb":
-            username = user['username']
-        print("username: ", username)
-        access_token = self.create_access_token(
-                            data={"sub": username}, 
-                            expires_delta=access_token_expires,
-                            status="active"
+        await self.keys.ensure_signing_key()
+        # the role's scopes travel in the token, routes check them without a lookup
+        access_token = self.encode_access_token(
+                            data={"sub": username, "sid": session_id,
+                                  "scope": self.roles.claim(role)},
+                            expires_delta=access_token_expires
                         )
-        return {"access_token": access_token, "token_type": "bearer"}
+        return {"access_token": access_token, "refresh_token": refresh_token,
+                "token_type": "bearer"}
+
+    async def refresh(self, refresh_token: str):
+        # One conditional update marks the presented token used, no user-row write
+        token_hash = hash_refresh_token(refresh_token)
+        record = await self.store.use_refresh_token(token_hash, datetime.utcnow())
+        if record is None:
+            previous = await self.store.get_refresh_token(token_hash)
+            if previous is not None and previous['used']:
+                # A rotated token came back: assume it was stolen and end the session
+                await self.revoke_session(previous['username'])
+                raise HTTPException(
+                    status_code=401, detail="Refresh token reuse detected! Login again")
+            raise HTTPException(status_code=401, detail="Invalid or expired refresh token")
+
+        # a role change ends the session, so the session's role is still current
+        role = record.get('role') or await self._current_role(record['username'])
+        await self.keys.ensure_signing_key()
+        access_token = self.encode_access_token(
+            data={"sub": record['username'], "sid": record['family_id'],
+                  "scope": self.roles.claim(role)})
+        new_refresh_token = await self.issue_refresh_token(
+            record['username'], record['family_id'], record['expiration_time'], role=role)
+        return {"access_token": access_token, "refresh_token": new_refresh_token,
+                "token_type": "bearer"}
+
+    async def _current_role(self, username):
+        # sessions started before roles were recorded with their tokens
+        user = await self.store.get_user(username)
+        return self.roles.role_of(user) if user else "user"
+
+    async def issue_refresh_token(self, username, session_id, expiration_time: datetime = None,
+                                  prune_before: datetime = None, role: str = None):
+        # rotated tokens keep the expiry of the session they belong to
+        if expiration_time is None:
+            expiration_time = datetime.utcnow() + timedelta(
+                days=self.db.config.refresh_token_expire_days)
+        refresh_token = secrets.token_urlsafe(32)
+        await self.store.create_refresh_token(
+            hash_refresh_token(refresh_token), username, session_id, expiration_time,
+            prune_before=prune_before, role=role)
+        return refresh_token
 
+    async def _session_started(self, username, session_id, user: User = None):
+        # write through so the new session is served from the cache right away
+        self.session_cache.activate(username, session_id, user)
+        await self.sessions.publish_activation(username, session_id)
 
-    def logout(self, user):
-        if self.db.config.use_database == "postgresql":
-            user = get_pg_user_session(self.db, user.username)
-            update_pg_user_session(self.db, user.username, session=user.session_id, status="not active")
-            user = get_pg_user_session(self.db, user.username)
-        elif self.db.config.use_database == "mongodb":
-            collection = self.db.get_session().users
-            user = collection.update_one({"username": user.username}, {"$set": {"status": "not active"}})
+    async def revoke_session(self, username):
+        await self.store.set_status(username, "not active")
+        await self.store.delete_refresh_tokens(username)
+        self.session_cache.revoke_user(username)
+        await self.sessions.publish_revocation(username)
+
+
+    async def logout(self, user):
+        await self.revoke_session(user.username)
+        user = await self.store.get_profile(user.username)
         return {"user": user, "mssg": "sign out successfully"}
 
-    # NoSql -> `NoSQLUserDB` format user
+    # NoSql -> `MongoDBUserDB` format user
     # SQL -> `SQLUserDB`, MySQL, PostgreSQL, Sqlite
-    def create_user(self, user: User):
-        # print("Plain password: ", user.password, "type: ", type(user.password))
-        hashed_password = self.get_password_hash(user.password)
-        if self.db.config.use_database == "postgresql":
-            # Create user in PostgreSQL
-            db_user = SQLUserDB(username=user.username, 
-                                hashed_password=hashed_password, 
-                                is_superuser=user.is_superuser)
-            db = self.db.get_session()
-            db.add(db_user)
-            db.commit()
-            db.refresh(db_user)
-            return db_user
-        elif self.db.config.use_database == "mongodb":
-            user_data = NoSQLUserDB(username=user.username, 
-                                    hashed_password=hashed_password, 
-                                    is_superuser=user.is_superuser)
-            create_user(user_data)
-            # user = self.db.get_session().users.insert_one(user_data.dict())
-            return user_data
-            
-        else:
-            raise ValueError("Invalid database type. Please choose 'postgresql' or 'mongodb'.")
+    async def create_user(self, user: UserForm, creator: User = None):
+        # anyone can sign up as a "user", picking another role takes users:roles
+        role = "superuser" if user.is_superuser else user.role
+        if creator is None:
+            role = "user"
+        elif role != "user" and not self.has_scopes(creator, ["users:roles"]):
+            raise not_enough_permissions(["users:roles"])
+        self.check_role(role)
+        hashed_password = await self.get_password_hash(user.password)
+        return await self.store.create_user(
+            user.username, hashed_password, role == "superuser", role)
+
+    def check_role(self, role):
+        if role not in self.roles.roles:
+            raise HTTPException(status_code=400, detail=f"Unknown role: {role}")
+
+    async def set_role(self, username, role):
+        # tokens carry the old role's scopes, so the user's session is ended
+        self.check_role(role)
+        if not await self.store.set_role(username, role, role == "superuser"):
+            raise HTTPException(status_code=404, detail="User not found")
+        await self.revoke_session(username)
+        return await self.find_me(username)
 
-    def create_access_token(self, data: dict, expires_delta: timedelta = None, status: str = "active"):
+    # Stateless: the session is referenced by the `sid` claim
+    def encode_access_token(self, data: dict, expires_delta: timedelta = None):
         to_encode = data.copy()
         if expires_delta:
             expire = datetime.utcnow() + expires_delta
         else:
             expire = datetime.utcnow() + timedelta(minutes=self.db.config.access_token_expire_minutes)
         to_encode.update({"exp": expire})
-        encoded_jwt = jwt.encode(to_encode, self.db.config.secret_key, 
-                                 algorithm=self.db.config.algorithm)
-
-        if self.db.config.use_database == "mongodb":
-            update_mongo_user({"username": data['sub']},  {
-                        "$push": {"sessions": {encoded_jwt: {}}}, 
-                        "$set": {"session_id": encoded_jwt, "status": status}})
-        elif self.db.config.use_database == "postgresql":
-            update_pg_user_session(self.db, username=data['sub'],
-                                session=encoded_jwt, status=status)
-         
-        print(encoded_jwt)
-        return encoded_jwt
-
-    def verify_password(self, plain_password, hashed_password):
-        return passlib_context.verify(plain_password, hashed_password)
-
-    def get_password_hash(self, password):
-        return passlib_context.hash(password)
-
-    def get_current_user(self, token: str = Depends(oauth2_scheme)):
-        try:
-            payload = jwt.decode(token, self.db.config.secret_key, 
-                algorithms=[self.db.config.algorithm])
-            username: str = payload.get("sub").strip()
-            print("username", username, "username")
-            if username is None:
-                raise HTTPException(status_code=401, 
-                                    detail="Could not validate credentials")
-            if "exp" in payload:
-                expiration_time = datetime.fromtimestamp(payload["exp"])
-                current_time = datetime.utcnow()
-                if current_time > expiration_time:
-                    raise HTTPException(status_code=403, detail="Token expired!")
-            
-            if self.db.config.use_database == "postgresql":
-                db_user = self.db.get_session().query(SQLUserDB)\
-                            .filter(SQLUserDB.username == username)\
-                            .first()
-                if db_user is None:
-                    raise HTTPException(status_code=401, detail="User not found")
-                elif db_user.status != 'active':
-                    raise HTTPException(
-                        status_code=401, detail="You have logged out! Login again")
-                return User(username=db_user.username, is_superuser=db_user.is_superuser)
-            
-            elif self.db.config.use_database == "mongodb":
-                user_data = find_user({"username": username}) 
-                if user_data is None:
-                    raise HTTPException(
-                        status_code=401, detail="User not found")
-                elif user_data['status'] != 'active':
-                    raise HTTPException(
-                        status_code=401, detail="You have logged out! Login again")
-                return User(username=user_data['username'], is_superuser=user_data['is_superuser'])
-            else:
-                raise ValueError("Invalid database type. Please choose 'postgresql' or 'mongodb'.")
+        with self.metrics.stage("jwt_encode"):
+            key = self.keys.signing_key()
+            return jwt.encode(to_encode, key.private_key, algorithm=key.algorithm,
+                              headers={"kid": key.kid} if key.kid else None)
+
+    async def verify_password(self, plain_password, hashed_password):
+        with self.metrics.stage("verify_password"):
+            return await self.hasher.verify(plain_password, hashed_password)
+
+    async def verify_and_update_password(self, plain_password, hashed_password):
+        with self.metrics.stage("verify_password"):
+            return await self.hasher.verify_and_update(plain_password, hashed_password)
+
+    async def get_password_hash(self, password):
+        with self.metrics.stage("hash_password"):
+            return await self.hasher.hash(password)
 
+    def decode_token(self, token: str, **options):
+        with self.metrics.stage("jwt_decode"):
+            key = self.keys.verification_key(jwt.get_unverified_header(token).get("kid"))
+            if key is None:
+                raise PyJWTError("Unknown signing key")
+            return jwt.decode(token, key.public_key, algorithms=[key.algorithm], **options)
 
+    def check_scopes(self, payload, scopes):
+        # a frozenset per distinct claim, so this is a set lookup per scope
+        if scopes and not parse_scope_claim(payload.get("scope", "")).issuperset(scopes):
+            raise not_enough_permissions(scopes)
+
+    def has_scopes(self, user: User, scopes) -> bool:
+        # for permissions that depend on the request body rather than the route,
+        # a role change ends the session, so the user's role matches the token
+        return self.roles.scopes(user.role).issuperset(scopes)
+
+    def decode_access_token(self, token: str, allow_expired: bool = False):
+        # Expiry is decided per call, an expired token is only let through
+        # where the caller asks for it
+        try:
+            return self.decode_token(token)
         except ExpiredSignatureError:
-            print(self.db.config.RAISE_EXPIRED_ERROR)
-            if self.db.config.RAISE_EXPIRED_ERROR:
+            if not allow_expired:
                 raise HTTPException(status_code=403, detail="Token expired!")
-            # return User(username=db_user.username)
-            payload = jwt.decode(token, self.db.config.secret_key, 
-                algorithms=[self.db.config.algorithm], options={"verify_signature": False})
-            username: str = payload.get("sub").strip()
-            # print("username", username, "username")
-            self.db.config.RAISE_EXPIRED_ERROR = True
-            return User(username=username, is_superuser=False)
+            return self.decode_token(token, options={"verify_exp": False})
 
+    async def get_current_user(self, token: str = Depends(oauth2_scheme), scopes=(),
+                               allow_expired: bool = False):
+        try:
+            await self.keys.ensure_verification_key(jwt.get_unverified_header(token).get("kid"))
+            payload = self.decode_access_token(token, allow_expired)
         except PyJWTError as e:
-            print(e)
+            logger.info("Rejected token: %s", e)
             raise HTTPException(status_code=401, detail="Could not validate credentials")
-   
-    def find_me(self, username):       
-        print(username, "username")
-        if self.db.config.use_database == "postgresql":
-            user = self.db.get_session().query(SQLUserDB).filter(SQLUserDB.username == username).first()
-        elif self.db.config.use_database == "mongodb":
-            collection = self.db.get_session().users
-            user = collection.find_one({"username": username}, {"_id": False, "hashed_password": False})
+        username: str = (payload.get("sub") or "").strip()
+        if not username:
+            raise HTTPException(status_code=401,
+                                detail="Could not validate credentials")
+
+        if self.sessions.is_revoked(username):
+            raise HTTPException(
+                status_code=401, detail="You have logged out! Login again")
+        self.check_scopes(payload, scopes)
+
+        # tokens issued before sessions had ids are keyed by the token itself
+        session_id = payload.get("sid") or token
+        cached = self.session_cache.get(username, session_id)
+        if cached is not None and not cached.active:
+            raise HTTPException(
+                status_code=401, detail="You have logged out! Login again")
+        if cached is not None and cached.user is not None:
+            return cached.user
+
+        db_user = await self.store.get_user(username)
+        if db_user is None:
+            raise HTTPException(status_code=401, detail="User not found")
+        user = User(username=db_user['username'], is_superuser=db_user['is_superuser'],
+                    role=self.roles.role_of(db_user))
+        active = db_user['status'] == 'active' and db_user['session_id'] == session_id
+        self.session_cache.put(username, session_id, active, user)
+        if not active:
+            raise HTTPException(
+                status_code=401, detail="You have logged out! Login again")
+        return user
+
+    async def find_me(self, username):       
+        user = self.session_cache.get_profile(username)
+        if user is None:
+            user = await self.store.get_profile(username)
+            if user:
+                self.session_cache.put_profile(username, user)
 
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         return user
  
-def get_current_active_user(current_user: User = Security(Auth.get_current_user, scopes=["superuser"])):
-    # Check user permissions
-    if not current_user.is_superuser:
-        raise HTTPException(status_code=403, detail="Insufficient permissions")
+# App-scoped dependencies, `create_app` keeps each application's `Auth` on
+# `app.state`, or `TenantMiddleware` the tenant's in the request state.
+# async so FastAPI does not hop to the threadpool to resolve it
+async def get_auth(request: Request) -> Auth:
+    return request.scope.get("state", {}).get("auth") or request.app.state.auth
+
+
+# One scoped session per request on the request's pool, closed after the
+# response: a SQLAlchemy Session or pymongo database, or their async
+# counterparts in `async_mode`. Sync sessions are checked out on the threadpool.
+async def get_db(auth: Auth = Depends(get_auth)):
+    if auth.db.config.async_mode:
+        async with auth.db.async_session_scope() as session:
+            yield session
+    else:
+        async with contextmanager_in_threadpool(auth.db.session_scope()) as session:
+            yield session
+
+
+# `Security(get_current_user, scopes=[...])` requires the scopes of the token
+async def get_current_user(security_scopes: SecurityScopes,
+                           token: str = Depends(oauth2_scheme),
+                           auth: Auth = Depends(get_auth)) -> User:
+    return await auth.get_current_user(token, security_scopes.scopes)
+
+
+# For routes that still serve a live session after its access token expired,
+# e.g. logging out
+async def get_current_user_allow_expired(security_scopes: SecurityScopes,
+                                         token: str = Depends(oauth2_scheme),
+                                         auth: Auth = Depends(get_auth)) -> User:
+    return await auth.get_current_user(token, security_scopes.scopes, allow_expired=True)
+
+
+# `None` for anonymous callers, a presented token must still be valid
+async def get_optional_user(token: str = Depends(optional_oauth2_scheme),
+                            auth: Auth = Depends(get_auth)) -> User:
+    if token is None:
+        return None
+    return await auth.get_current_user(token)
+
+
+def get_current_active_user(current_user: User = Security(get_current_user, scopes=["superuser"])):
     return current_user
@@ -0,0 +1,132 @@
+# my_authentication_app/authentication/bulk.py
+import csv
+import io
+import itertools
+import json
+import time
+
+from starlette.concurrency import run_in_threadpool
+
+TRUE_VALUES = ("1", "true", "yes", "y", "t")
+
+
+def parse_users(fh, fmt: str):
+    """Yield (line number, row dict or error message) from a CSV or NDJSON file.
+
+    CSV files need a header with `username` and `password`, `is_superuser`
+    is optional. NDJSON files hold one object per line with the same keys.
+    """
+    text = io.TextIOWrapper(fh, encoding="utf-8", newline="")
+    if fmt == "csv":
+        reader = csv.DictReader(text)
+        for line, row in enumerate(reader, start=2):
+            yield line, row
+    elif fmt == "ndjson":
+        for line, raw in enumerate(text, start=1):
+            if not raw.strip():
+                continue
+            try:
+                row = json.loads(raw)
+            except ValueError:
+                yield line, "invalid JSON"
+                continue
+            yield line, row if isinstance(row, dict) else "expected a JSON object"
+    else:
+        raise ValueError("Invalid format. Please choose 'csv' or 'ndjson'.")
+
+
+async def read_users(fh, fmt: str, batch_size: int = 1000):
+    """Async iterator over `parse_users`.
+
+    The upload may be spooled to disk, so it is read and parsed on the
+    threadpool, `batch_size` rows per hop, instead of on the event loop.
+    """
+    rows = parse_users(fh, fmt)
+    while True:
+        batch = await run_in_threadpool(list, itertools.islice(rows, batch_size))
+        if not batch:
+            return
+        for row in batch:
+            yield row
+
+
+def _validate(row, allow_superusers=False):
+    if isinstance(row, str):
+        return None, row
+    username = str(row.get("username") or "").strip()
+    password = row.get("password")
+    if not username or not password:
+        return None, "username and password are required"
+    is_superuser = row.get("is_superuser", False)
+    if isinstance(is_superuser, str):
+        is_superuser = is_superuser.strip().lower() in TRUE_VALUES
+    if is_superuser and not allow_superusers:
+        return None, "is_superuser needs the users:roles scope"
+    # the same role `Auth.create_user` gives a superuser
+    return {"username": username, "password": str(password),
+            "is_superuser": bool(is_superuser),
+            "role": "superuser" if is_superuser else "user"}, None
+
+
+async def provision_users(auth, rows, chunk_size: int = 1000, allow_superusers: bool = False):
+    """Create users in chunks and yield a progress report after each chunk.
+
+    `rows` is an async iterator of (line number, row), see `read_users`.
+    Passwords of a chunk are hashed in parallel on the hasher's bulk pool,
+    then the chunk is written with one batch insert. Invalid rows and
+    duplicates (already stored or repeated in the file) are reported per row
+    without aborting the batch. Rows with `is_superuser` are invalid unless
+    `allow_superusers`. The last report has `done` set.
+    """
+    started = time.perf_counter()
+    totals = {"processed": 0, "created": 0, "duplicates": 0, "errors": 0}
+    seen = set()
+    chunk_number = 0
+
+    async def flush(chunk, report):
+        hashes = await auth.hasher.hash_many([user.pop("password") for _, user in chunk])
+        for (_, user), hashed_password in zip(chunk, hashes):
+            user["hashed_password"] = hashed_password
+        duplicates = await auth.store.bulk_create_users([user for _, user in chunk])
+        for line, user in chunk:
+            if user["username"] in duplicates:
+                report["duplicate_rows"].append({"line": line, "username": user["username"]})
+        totals["created"] += len(chunk) - len(duplicates)
+
+    chunk, report = [], {"duplicate_rows": [], "error_rows": []}
+    async for line, row in rows:
+        user, error = _validate(row, allow_superusers)
+        if user is not None and user["username"] in seen:
+            report["duplicate_rows"].append({"line": line, "username": user["username"]})
+        elif user is not None:
+            seen.add(user["username"])
+            chunk.append((line, user))
+        else:
+            report["error_rows"].append({"line": line, "error": error})
+        totals["processed"] += 1
+
+        if len(chunk) >= chunk_size:
+            await flush(chunk, report)
+            chunk_number += 1
+            yield _progress(chunk_number, report, totals, started)
+            chunk, report = [], {"duplicate_rows": [], "error_rows": []}
+
+    if chunk:
+        await flush(chunk, report)
+    if chunk or report["duplicate_rows"] or report["error_rows"]:
+        chunk_number += 1
+        yield _progress(chunk_number, report, totals, started)
+    yield {"done": True, **_totals(totals, started)}
+
+
+def _progress(chunk_number, report, totals, started):
+    totals["duplicates"] += len(report["duplicate_rows"])
+    totals["errors"] += len(report["error_rows"])
+    return {"chunk": chunk_number, **report, **_totals(totals, started)}
+
+
+def _totals(totals, started):
+    elapsed = time.perf_counter() - started
+    return {**totals,
+            "elapsed_seconds": round(elapsed, 3),
+            "rows_per_second": round(totals["processed"] / elapsed, 1) if elapsed else 0.0}
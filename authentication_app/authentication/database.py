@@ -1,27 +1,260 @@
 # my_authentication_app/authentication/database.py
 # import certifi
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from pymongo import MongoClient
-from pymongo.collection import Collection
-from pymongo.database import Database
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
 from .config import AuthConfig
+from .metrics import Metrics
+
+
+class PoolStats:
+    """Thread-safe checkout/wait/overflow counters for one connection pool."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.checkout_failures = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.peak_overflow = 0
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+    def record_overflow(self, overflow):
+        with self._lock:
+            self.peak_overflow = max(self.peak_overflow, overflow)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "checkout_failures": self.checkout_failures,
+                "wait_seconds_total": round(self.wait_seconds_total, 6),
+                "wait_seconds_max": round(self.wait_seconds_max, 6),
+                "peak_overflow": self.peak_overflow,
+            }
+
 
 class Database:
-    def __init__(self, config: AuthConfig):
+    """Process-wide registry of the engine or client for the configured backend.
+
+    `connect()` is called once at application startup and `dispose()` at
+    shutdown. `get_session()` hands out sessions bound to the shared pool, and
+    lazily connects so module level users keep working outside the app. With
+    `async_mode` an asyncpg engine or Motor client is registered as well and
+    served by `get_async_session()`.
+
+    Only the driver of the selected backend is imported, and only on
+    `connect()`, so building a `Database` is cheap.
+    """
+
+    def __init__(self, config: AuthConfig, metrics: Metrics = None):
         self.config = config
+        self.engine = None
+        self.client = None
+        self._sessionmaker = None
+        self.async_engine = None
+        self.async_client = None
+        self._async_sessionmaker = None
+        self._lock = threading.Lock()
+        self.stats = PoolStats()
+        # tenants of one process report into the same metrics
+        self.metrics = metrics or Metrics(enabled=config.metrics_enabled)
+
+    def connect(self):
+        with self._lock:
+            if self.engine is not None or self.client is not None:
+                return
+            if self.config.use_database == "postgresql":
+                from sqlalchemy import create_engine
+                from sqlalchemy.orm import sessionmaker
+
+                self.engine = self._instrument_engine(
+                    create_engine(self.config.postgresql_uri, **self._engine_options()))
+                self._sessionmaker = sessionmaker(
+                    autocommit=False, autoflush=False, bind=self.engine)
+                if self.config.async_mode:
+                    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+                    self.async_engine = create_async_engine(
+                        self.config.postgresql_async_uri, **self._engine_options())
+                    self._instrument_engine(self.async_engine.sync_engine)
+                    self._async_sessionmaker = async_sessionmaker(
+                        self.async_engine, autoflush=False, expire_on_commit=False)
+            elif self.config.use_database == "mongodb":
+                self.client = self._create_mongo_client()
+                if self.config.async_mode:
+                    from motor.motor_asyncio import AsyncIOMotorClient
+
+                    self.async_client = AsyncIOMotorClient(
+                        self.config.mongodb_uri, **self._client_options())
+            else:
+                raise ValueError("Invalid database type. Please choose 'postgresql' or 'mongodb'.")
+
+    def _create_mongo_client(self):
+        from pymongo import MongoClient
+
+        return MongoClient(self.config.mongodb_uri, **self._client_options())
+
+    def _engine_options(self):
+        return {
+            "pool_size": self.config.pool_size,
+            "max_overflow": self.config.pool_max_overflow,
+            "pool_recycle": self.config.pool_recycle,
+            "pool_pre_ping": self.config.pool_pre_ping,
+            "pool_timeout": self.config.pool_timeout,
+        }
+
+    def _client_options(self):
+        from .mongo_monitoring import MongoCommandListener, MongoPoolListener
+
+        return {
+            "maxPoolSize": self.config.pool_size + self.config.pool_max_overflow,
+            "minPoolSize": self.config.mongodb_min_pool_size,
+            "maxIdleTimeMS": self.config.pool_recycle * 1000,
+            "waitQueueTimeoutMS": self.config.pool_timeout * 1000,
+            "event_listeners": [MongoPoolListener(self.stats),
+                                MongoCommandListener(self.metrics)],
+        }
+
+    def _instrument_engine(self, engine):
+        from sqlalchemy import event
+
+        @event.listens_for(engine, "connect")
+        def on_connect(dbapi_connection, connection_record):
+            self.stats.incr("connects")
+
+        @event.listens_for(engine, "checkout")
+        def on_checkout(dbapi_connection, connection_record, connection_proxy):
+            self.stats.incr("checkouts")
+            self.stats.record_overflow(max(engine.pool.overflow(), 0))
+
+        @event.listens_for(engine, "checkin")
+        def on_checkin(dbapi_connection, connection_record):
+            self.stats.incr("checkins")
+
+        if self.metrics.enabled:
+            @event.listens_for(engine, "before_cursor_execute")
+            def before_query(conn, cursor, statement, parameters, context, executemany):
+                conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+            @event.listens_for(engine, "after_cursor_execute")
+            def after_query(conn, cursor, statement, parameters, context, executemany):
+                started = conn.info["query_started"].pop()
+                self.metrics.record_db_call(time.perf_counter() - started)
+
+        return engine
+
+    def dispose(self):
+        with self._lock:
+            if self.engine is not None:
+                self.engine.dispose()
+                self.engine = None
+                self._sessionmaker = None
+            if self.client is not None:
+                self.client.close()
+                self.client = None
+
+    async def dispose_async(self):
+        self.dispose()
+        if self.async_engine is not None:
+            await self.async_engine.dispose()
+            self.async_engine = None
+            self._async_sessionmaker = None
+        if self.async_client is not None:
+            self.async_client.close()
+            self.async_client = None
 
     def get_session(self):
+        if self.engine is None and self.client is None:
+            self.connect()
         if self.config.use_database == "postgresql":
-            engine = create_engine(self.config.postgresql_uri)
-            SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-            return SessionLocal()
+            return self._sessionmaker()
         elif self.config.use_database == "mongodb":
-            client = MongoClient(self.config.mongodb_uri)
-            db = client[self.config.mongodb_db_name]
-            return db
+            return self.client[self.config.mongodb_db_name]
         else:
             raise ValueError("Invalid database type. Please choose 'postgresql' or 'mongodb'.")
 
-conf = AuthConfig()
-db = Database(conf)
+    @contextmanager
+    def session_scope(self):
+        session = self.get_session()
+        if self.config.use_database != "postgresql":
+            # Mongo databases are handles on the shared client, nothing to close.
+            yield session
+            return
+        from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+        # Check the connection out up front so the time spent waiting on a
+        # saturated pool shows up in the stats.
+        started = time.perf_counter()
+        try:
+            session.connection()
+        except PoolTimeoutError:
+            self.stats.incr("checkout_failures")
+            session.close()
+            raise
+        self.stats.record_wait(time.perf_counter() - started)
+        try:
+            yield session
+        finally:
+            session.close()
+
+    def get_async_session(self):
+        if not self.config.async_mode:
+            raise RuntimeError("Async sessions require `async_mode` to be enabled.")
+        if self.engine is None and self.client is None:
+            self.connect()
+        if self.config.use_database == "postgresql":
+            return self._async_sessionmaker()
+        elif self.config.use_database == "mongodb":
+            return self.async_client[self.config.mongodb_db_name]
+        else:
+            raise ValueError("Invalid database type. Please choose 'postgresql' or 'mongodb'.")
+
+    @asynccontextmanager
+    async def async_session_scope(self):
+        session = self.get_async_session()
+        if self.config.use_database != "postgresql":
+            yield session
+            return
+        from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+        started = time.perf_counter()
+        try:
+            await session.connection()
+        except PoolTimeoutError:
+            self.stats.incr("checkout_failures")
+            await session.close()
+            raise
+        self.stats.record_wait(time.perf_counter() - started)
+        try:
+            yield session
+        finally:
+            await session.close()
+
+    def pool_stats(self):
+        stats = self.stats.snapshot()
+        engines = [self.engine]
+        if self.async_engine is not None:
+            engines.append(self.async_engine.sync_engine)
+        for engine in engines:
+            if engine is None:
+                continue
+            pool = engine.pool
+            stats["size"] = stats.get("size", 0) + pool.size()
+            stats["checked_out"] = stats.get("checked_out", 0) + pool.checkedout()
+            stats["overflow"] = stats.get("overflow", 0) + max(pool.overflow(), 0)
+        return stats
+
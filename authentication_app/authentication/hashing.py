@@ -0,0 +1,185 @@
+# my_authentication_app/authentication/hashing.py
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+from .metrics import Histogram
+
+# Per-process context for the process pool, rebuilt from the parent's config
+_worker_context = None
+
+
+def _init_worker(context_config):
+    global _worker_context
+    _worker_context = CryptContext.from_string(context_config)
+
+
+def _worker_hash(secret):
+    return _worker_context.hash(secret)
+
+
+def _worker_verify(secret, hashed):
+    return _worker_context.verify(secret, hashed)
+
+
+def _worker_verify_and_update(secret, hashed):
+    return _worker_context.verify_and_update(secret, hashed)
+
+
+def build_crypt_context(config) -> CryptContext:
+    """CryptContext for the schemes and costs in `AuthConfig`.
+
+    The first of `password_schemes` hashes new passwords, the others are only
+    accepted for verification and flagged for re-hashing. Hashes of the default
+    scheme made with a lower cost than configured are flagged as well.
+    """
+    schemes = [scheme.strip() for scheme in config.password_schemes.split(",") if scheme.strip()]
+    if not schemes:
+        raise ValueError("At least one password scheme must be configured.")
+    settings = {}
+    if "bcrypt" in schemes:
+        settings.update(bcrypt__rounds=config.bcrypt_rounds,
+                        bcrypt__min_rounds=config.bcrypt_rounds)
+    if "argon2" in schemes:
+        settings.update(argon2__rounds=config.argon2_time_cost,
+                        argon2__memory_cost=config.argon2_memory_cost,
+                        argon2__parallelism=config.argon2_parallelism)
+    if "pbkdf2_sha256" in schemes:
+        settings.update(pbkdf2_sha256__rounds=config.pbkdf2_rounds,
+                        pbkdf2_sha256__min_rounds=config.pbkdf2_rounds)
+    return CryptContext(schemes=schemes, deprecated="auto", **settings)
+
+
+class PasswordHasher:
+    """Runs the password KDF off the event loop on a bounded worker pool.
+
+    bcrypt releases the GIL, so a thread pool scales across cores; a process
+    pool is available for schemes that do not. At most `max_in_flight` hashes
+    run at once and at most `max_queue` wait behind them, beyond that callers
+    get an immediate 503 so login bursts cannot starve cheap requests.
+
+    Bulk provisioning hashes on a separate pool of the same kind with
+    `bulk_workers` workers, a quarter of the cores by default, so an import
+    leaves the rest of the CPU to logins. Process pools are spawned rather
+    than forked, forking a server that runs other threads can deadlock the
+    child.
+    """
+
+    def __init__(self, context: CryptContext, executor: str = "thread",
+                 workers: int = 4, max_in_flight: int = 4, max_queue: int = 64,
+                 bulk_workers: int = 0):
+        if executor not in ("thread", "process"):
+            raise ValueError("Invalid hash executor. Please choose 'thread' or 'process'.")
+        self.context = context
+        self.executor_kind = executor
+        self.workers = workers
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self._executor = None
+        # bulk provisioning gets its own pool so it never competes with
+        # logins for `max_in_flight`
+        self.bulk_workers = bulk_workers or max((os.cpu_count() or 1) // 4, 1)
+        self._bulk_executor = None
+        self._semaphore = None
+        self._pending = 0
+        self.peak_queue_depth = 0
+        self.rejected = 0
+        self.latency = Histogram()
+
+    @classmethod
+    def from_config(cls, config, context: CryptContext = None):
+        return cls(context or build_crypt_context(config),
+                   executor=config.hash_executor,
+                   workers=config.hash_workers,
+                   max_in_flight=config.hash_max_in_flight,
+                   max_queue=config.hash_max_queue,
+                   bulk_workers=config.bulk_hash_workers)
+
+    def _new_executor(self, workers, name):
+        if self.executor_kind == "process":
+            return ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.context.to_string(),))
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = self._new_executor(self.workers, "password-hash")
+        return self._executor
+
+    def _functions(self):
+        if self.executor_kind == "process":
+            return _worker_hash, _worker_verify, _worker_verify_and_update
+        return self.context.hash, self.context.verify, self.context.verify_and_update
+
+    @property
+    def queue_depth(self):
+        return max(self._pending - self.max_in_flight, 0)
+
+    async def _run(self, fn, *args):
+        if self._pending >= self.max_in_flight + self.max_queue:
+            self.rejected += 1
+            raise HTTPException(status_code=503,
+                                detail="Server busy, try again later",
+                                headers={"Retry-After": "1"})
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        self._pending += 1
+        self.peak_queue_depth = max(self.peak_queue_depth, self.queue_depth)
+        try:
+            async with self._semaphore:
+                started = time.perf_counter()
+                result = await asyncio.get_running_loop().run_in_executor(
+                    self._get_executor(), fn, *args)
+                self.latency.observe(time.perf_counter() - started)
+                return result
+        finally:
+            self._pending -= 1
+
+    async def hash(self, secret):
+        hash_fn, _, _ = self._functions()
+        return await self._run(hash_fn, secret)
+
+    async def verify(self, secret, hashed):
+        _, verify_fn, _ = self._functions()
+        return await self._run(verify_fn, secret, hashed)
+
+    async def verify_and_update(self, secret, hashed):
+        """Returns (valid, new_hash), new_hash is set when `hashed` is outdated."""
+        _, _, verify_and_update_fn = self._functions()
+        return await self._run(verify_and_update_fn, secret, hashed)
+
+    async def hash_many(self, secrets):
+        # the pool's worker count bounds how many of them hash at once
+        if self._bulk_executor is None:
+            self._bulk_executor = self._new_executor(self.bulk_workers, "bulk-password-hash")
+        hash_fn, _, _ = self._functions()
+        loop = asyncio.get_running_loop()
+        return await asyncio.gather(*(
+            loop.run_in_executor(self._bulk_executor, hash_fn, secret)
+            for secret in secrets))
+
+    def stats(self):
+        return {
+            "executor": self.executor_kind,
+            "in_flight": min(self._pending, self.max_in_flight),
+            "queue_depth": self.queue_depth,
+            "peak_queue_depth": self.peak_queue_depth,
+            "rejected": self.rejected,
+            "latency_seconds": self.latency.snapshot(),
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        if self._bulk_executor is not None:
+            self._bulk_executor.shutdown(wait=False)
+            self._bulk_executor = None
@@ -0,0 +1,230 @@
+# my_authentication_app/authentication/keys.py
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from jwt.algorithms import ECAlgorithm, OKPAlgorithm, RSAAlgorithm
+from starlette.concurrency import run_in_threadpool
+
+SYMMETRIC_ALGORITHMS = ("HS256", "HS384", "HS512")
+ASYMMETRIC_ALGORITHMS = ("RS256", "RS384", "RS512", "ES256", "EdDSA")
+
+
+class SigningKey:
+    __slots__ = ("kid", "algorithm", "private_key", "public_key", "created_at")
+
+    def __init__(self, kid, algorithm, private_key, public_key, created_at):
+        self.kid = kid
+        self.algorithm = algorithm
+        self.private_key = private_key
+        self.public_key = public_key
+        self.created_at = created_at
+
+
+def _generate_private_key(algorithm):
+    from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+
+    if algorithm.startswith("RS"):
+        return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    elif algorithm == "ES256":
+        return ec.generate_private_key(ec.SECP256R1())
+    return ed25519.Ed25519PrivateKey.generate()
+
+
+def _to_jwk(key: SigningKey):
+    if key.algorithm.startswith("RS"):
+        jwk = RSAAlgorithm.to_jwk(key.public_key)
+    elif key.algorithm.startswith("ES"):
+        jwk = ECAlgorithm.to_jwk(key.public_key)
+    else:
+        jwk = OKPAlgorithm.to_jwk(key.public_key)
+    jwk = json.loads(jwk) if isinstance(jwk, str) else jwk
+    jwk.update({"kid": key.kid, "alg": key.algorithm, "use": "sig"})
+    return jwk
+
+
+class KeyRing:
+    """Parsed JWT keys, selected by `kid`.
+
+    HS* algorithms use `secret_key` as a single key. RS*/ES256/EdDSA need a
+    `jwt_key_dir` shared by every worker (and tenant bundle), their private
+    keys are read once from `<kid>.pem` files and the parsed key objects are
+    reused for every encode/decode. The newest key signs; once it is older
+    than `jwt_key_rotation_hours` the workers take an exclusive lock on the
+    directory, the first one writes a new key and the others load it. A
+    replaced key keeps verifying for `retire_after_seconds`, the refresh token
+    lifetime, since logout accepts an expired access token for as long as its
+    session lasts, then its `.pem` file is deleted. An unknown `kid` reloads
+    the directory when a key was added, and otherwise at most every
+    `reload_interval` seconds. Async callers await `ensure_signing_key` /
+    `ensure_verification_key` first, so rotating and reloading, which take
+    the locks and touch the disk, run on the threadpool.
+    """
+
+    def __init__(self, algorithm: str, secret_key: str = None, key_dir: str = "",
+                 rotation_hours: float = 720, retire_after_seconds: float = 7 * 86400,
+                 reload_interval: float = 60):
+        if algorithm not in SYMMETRIC_ALGORITHMS + ASYMMETRIC_ALGORITHMS:
+            raise ValueError(f"Unsupported JWT algorithm: {algorithm}")
+        if algorithm in ASYMMETRIC_ALGORITHMS and not key_dir:
+            # a key per process would reject every other worker's tokens
+            raise ValueError(f"{algorithm} needs a jwt_key_dir shared by all workers")
+        self.algorithm = algorithm
+        self.key_dir = key_dir
+        self.rotation_seconds = rotation_hours * 3600
+        self.retire_after = retire_after_seconds
+        self.reload_interval = reload_interval
+        self._keys = {}
+        self._retired = set()
+        self._current = None
+        self._last_reload = 0.0
+        self._dir_mtime = None
+        self._lock = threading.Lock()
+        if algorithm in SYMMETRIC_ALGORITHMS:
+            self._current = SigningKey(None, algorithm, secret_key, secret_key, time.time())
+        else:
+            os.makedirs(self.key_dir, exist_ok=True)
+            with self._lock:
+                self._load()
+            if self._current is None:
+                self.rotate()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.algorithm,
+                   secret_key=config.secret_key,
+                   key_dir=config.jwt_key_dir,
+                   rotation_hours=config.jwt_key_rotation_hours,
+                   retire_after_seconds=config.refresh_token_expire_days * 86400,
+                   reload_interval=config.jwt_key_reload_interval)
+
+    @property
+    def symmetric(self):
+        return self.algorithm in SYMMETRIC_ALGORITHMS
+
+    def _stat_dir(self):
+        try:
+            return os.stat(self.key_dir).st_mtime_ns
+        except OSError:
+            return None
+
+    def _load(self):
+        from cryptography.hazmat.primitives.serialization import load_pem_private_key
+
+        self._last_reload = time.monotonic()
+        # taken before listing, a key written meanwhile triggers another reload
+        self._dir_mtime = self._stat_dir()
+        if not os.path.isdir(self.key_dir):
+            return
+        for name in os.listdir(self.key_dir):
+            kid, ext = os.path.splitext(name)
+            if ext != ".pem" or kid in self._keys or kid in self._retired:
+                continue
+            path = os.path.join(self.key_dir, name)
+            try:
+                with open(path, "rb") as fh:
+                    private_key = load_pem_private_key(fh.read(), password=None)
+                created_at = os.path.getmtime(path)
+            except FileNotFoundError:
+                # retired and deleted by another worker meanwhile
+                continue
+            self._add(SigningKey(kid, self.algorithm, private_key,
+                                 private_key.public_key(), created_at))
+        self._retire()
+
+    def _add(self, key):
+        self._keys[key.kid] = key
+        if self._current is None or key.created_at > self._current.created_at:
+            self._current = key
+
+    def _retire(self):
+        # a key can go once its successor has been signing for `retire_after`,
+        # and its file with it so no worker parses it again
+        now = time.time()
+        ordered = sorted(self._keys.values(), key=lambda key: key.created_at)
+        for older, newer in zip(ordered, ordered[1:]):
+            if now - newer.created_at > self.retire_after:
+                self._keys.pop(older.kid, None)
+                self._retired.add(older.kid)
+                try:
+                    os.remove(os.path.join(self.key_dir, older.kid + ".pem"))
+                except FileNotFoundError:
+                    pass
+
+    def _due(self):
+        return self._current is None or time.time() - self._current.created_at > self.rotation_seconds
+
+    @contextmanager
+    def _rotation_lock(self):
+        # held by one worker at a time across every process sharing `key_dir`
+        import fcntl
+
+        with open(os.path.join(self.key_dir, ".rotate.lock"), "a") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _write_key(self, key):
+        from cryptography.hazmat.primitives import serialization
+
+        pem = key.private_key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption())
+        # written aside and renamed, so a reader never sees a partial key
+        tmp_path = os.path.join(self.key_dir, f".{key.kid}.tmp")
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(pem)
+        path = os.path.join(self.key_dir, key.kid + ".pem")
+        os.rename(tmp_path, path)
+        key.created_at = os.path.getmtime(path)
+
+    def rotate(self, force=False):
+        """Sign with a new key, unless another worker just wrote one."""
+        if self.symmetric:
+            return self._current
+        with self._lock, self._rotation_lock():
+            self._load()
+            if force or self._due():
+                private_key = _generate_private_key(self.algorithm)
+                key = SigningKey(uuid.uuid4().hex[:16], self.algorithm, private_key,
+                                 private_key.public_key(), time.time())
+                self._write_key(key)
+                self._add(key)
+                self._retire()
+            return self._current
+
+    def signing_key(self) -> SigningKey:
+        if not self.symmetric and self._due():
+            return self.rotate()
+        return self._current
+
+    async def ensure_signing_key(self):
+        if not self.symmetric and self._due():
+            await run_in_threadpool(self.rotate)
+
+    async def ensure_verification_key(self, kid):
+        if not self.symmetric and kid and kid not in self._keys:
+            await run_in_threadpool(self.verification_key, kid)
+
+    def verification_key(self, kid) -> SigningKey:
+        if self.symmetric:
+            return self._current
+        key = self._keys.get(kid)
+        if key is None and kid and (self._stat_dir() != self._dir_mtime or
+                                    time.monotonic() - self._last_reload > self.reload_interval):
+            with self._lock:
+                self._load()
+            key = self._keys.get(kid)
+        return key
+
+    def jwks(self):
+        if self.symmetric:
+            return {"keys": []}
+        return {"keys": [_to_jwk(key) for key in list(self._keys.values())]}
@@ -0,0 +1,216 @@
+# my_authentication_app/authentication/metrics.py
+import bisect
+import contextlib
+import contextvars
+import threading
+import time
+
+# Upper bounds in seconds, tuned for KDF and DB round-trip latencies
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram, safe to observe from any thread."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def snapshot(self):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative, running = {}, 0
+        for bound, count in zip(self.buckets, counts):
+            running += count
+            cumulative[str(bound)] = running
+        running += counts[-1]
+        cumulative["+Inf"] = running
+        return {"buckets": cumulative, "count": running, "sum": round(total, 6)}
+
+
+class StartupTimer:
+    """Wall time of each step of building and starting an application."""
+
+    def __init__(self):
+        self.phases = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round(time.perf_counter() - started, 4)
+
+    def report(self):
+        return {"phases": dict(self.phases),
+                "total_seconds": round(sum(self.phases.values()), 4)}
+
+
+# Buckets for counts per request, e.g. database round-trips
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21)
+
+
+class RequestStats:
+    __slots__ = ("db_calls",)
+
+    def __init__(self):
+        self.db_calls = 0
+
+
+# Set by MetricsMiddleware for the duration of a request. It holds a mutable
+# object so calls made from the threadpool (which runs in a copy of the
+# context) still count towards the request.
+current_request = contextvars.ContextVar("current_request", default=None)
+
+
+class _NoopTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NOOP_TIMER = _NoopTimer()
+
+
+class _StageTimer:
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started)
+        return False
+
+
+class Metrics:
+    """Latency histograms per stage and per route, plus DB calls per request.
+
+    With `enabled=False` every hook is a no-op, so instrumented code costs one
+    attribute check.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.stages = {}
+        self.requests = {}
+        self.db_calls = Histogram(COUNT_BUCKETS)
+        self._lock = threading.Lock()
+
+    def _histogram(self, registry, key):
+        histogram = registry.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = registry.setdefault(key, Histogram())
+        return histogram
+
+    def stage(self, name):
+        if not self.enabled:
+            return NOOP_TIMER
+        return _StageTimer(self._histogram(self.stages, name))
+
+    def record_db_call(self, seconds=None):
+        if not self.enabled:
+            return
+        request = current_request.get()
+        if request is not None:
+            request.db_calls += 1
+        if seconds is not None:
+            self._histogram(self.stages, "db_query").observe(seconds)
+
+    def observe_request(self, method, route, status, seconds, db_calls):
+        self._histogram(self.requests, (method, route, str(status))).observe(seconds)
+        self.db_calls.observe(db_calls)
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request and counting its DB calls."""
+
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+        self._route_paths = None
+
+    def _route(self, scope):
+        # label by route template, not raw path, to keep cardinality bounded
+        route = scope.get("route")
+        if route is not None:
+            return route.path
+        if self._route_paths is None and "app" in scope:
+            self._route_paths = {getattr(r, "endpoint", None): r.path
+                                 for r in scope["app"].routes}
+        return (self._route_paths or {}).get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.metrics.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        request = RequestStats()
+        token = current_request.set(request)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_request.reset(token)
+            self.metrics.observe_request(scope["method"], self._route(scope), status_code,
+                                         time.perf_counter() - started, request.db_calls)
+
+
+def _labels(**labels):
+    return ",".join(f'{key}="{value}"' for key, value in labels.items())
+
+
+def _render_histogram(lines, name, snapshot, labels=""):
+    prefix = labels + "," if labels else ""
+    for bound, count in snapshot["buckets"].items():
+        lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {count}')
+    suffix = "{" + labels + "}" if labels else ""
+    lines.append(f"{name}_count{suffix} {snapshot['count']}")
+    lines.append(f"{name}_sum{suffix} {snapshot['sum']}")
+
+
+def render_prometheus(metrics: Metrics, gauges=None):
+    """Prometheus text exposition of `metrics` plus flat `{name: value}` gauges."""
+    lines = ["# TYPE auth_stage_duration_seconds histogram"]
+    for stage, histogram in sorted(metrics.stages.items()):
+        _render_histogram(lines, "auth_stage_duration_seconds", histogram.snapshot(),
+                          _labels(stage=stage))
+    lines.append("# TYPE auth_http_request_duration_seconds histogram")
+    for (method, route, status), histogram in sorted(metrics.requests.items()):
+        _render_histogram(lines, "auth_http_request_duration_seconds", histogram.snapshot(),
+                          _labels(method=method, route=route, status=status))
+    lines.append("# TYPE auth_db_calls_per_request histogram")
+    _render_histogram(lines, "auth_db_calls_per_request", metrics.db_calls.snapshot())
+    for name, value in sorted((gauges or {}).items()):
+        if isinstance(value, dict):
+            lines.append(f"# TYPE {name} histogram")
+            _render_histogram(lines, name, value)
+        else:
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {float(value)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,63 @@
+# my_authentication_app/authentication/mongo_monitoring.py
+import threading
+import time
+
+from pymongo import monitoring
+
+from .metrics import Metrics
+
+
+class MongoPoolListener(monitoring.ConnectionPoolListener):
+    # pymongo reports check-out start/finish separately, so the wait time
+    # for a connection is the gap between the two events on the same thread.
+    def __init__(self, stats):
+        self.stats = stats
+        self._started = threading.local()
+
+    def connection_created(self, event):
+        self.stats.incr("connects")
+
+    def connection_check_out_started(self, event):
+        self._started.at = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        self.stats.incr("checkout_failures")
+
+    def connection_checked_out(self, event):
+        self.stats.incr("checkouts")
+        started = getattr(self._started, "at", None)
+        if started is not None:
+            self.stats.record_wait(time.perf_counter() - started)
+
+    def connection_checked_in(self, event):
+        self.stats.incr("checkins")
+
+    def pool_created(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    # one command is one database round-trip
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.metrics.record_db_call(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        self.metrics.record_db_call(event.duration_micros / 1e6)
@@ -0,0 +1,439 @@
+# my_authentication_app/authentication/mongo_stores.py
+from datetime import datetime
+
+from fastapi import HTTPException
+from pymongo import DeleteMany, InsertOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+
+from .mongodb_models import (MongoDBUserDB,
+                             create_user,
+                             find_user,
+                             update_mongo_user,
+                             user_document)
+from .responses import PROFILE_FIELDS
+from .stores import UserStore
+
+
+# `/me` fields, leaves out the secrets and the session history
+MONGO_PROFILE_PROJECTION = {"_id": False, **{name: True for name in PROFILE_FIELDS}}
+MONGO_REFRESH_PROJECTION = {"_id": False, "token": False}
+# Fields `/all` may return on MongoDB, `id` is the `_id`
+MONGO_USER_LIST_FIELDS = ("id", "username", "is_superuser", "status", "created_at", "role")
+
+
+# Projections are handed to the driver as fresh dicts, a driver that edits the
+# one it is given (mongomock pops `_id`) must not change it for other requests
+def _profile_projection():
+    return dict(MONGO_PROFILE_PROJECTION)
+
+
+def _refresh_projection():
+    return dict(MONGO_REFRESH_PROJECTION)
+
+
+def _refresh_token_doc(token, username, family_id, expiration_time, role=None):
+    return {"token": token, "username": username, "family_id": family_id,
+            "used": False, "expiration_time": expiration_time, "role": role}
+
+
+def _usable_refresh_token(token, now):
+    return {"token": token, "used": False, "expiration_time": {"$gt": now}}
+
+
+def _refresh_tokens_of(username, expired_before=None, family_id=None):
+    query = {"username": username}
+    if expired_before is not None:
+        query["expiration_time"] = {"$lt": expired_before}
+    if family_id is not None:
+        query["family_id"] = family_id
+    return query
+
+
+def _inactive_user(username):
+    return {"username": username, "status": {"$ne": "active"}}
+
+
+def _activate_session(session_id, history_limit):
+    # the session history keeps the last `history_limit` logins
+    return {"$push": {"sessions": {"$each": [{session_id: {}}], "$slice": -history_limit}},
+            "$set": {"session_id": session_id, "status": "active"}}
+
+
+def _expired_refresh_tokens(now):
+    return {"expiration_time": {"$lt": now}}
+
+
+def _active_on_sessions(tokens):
+    # users still on one of the tokens' sessions, a newer login is left alone
+    sessions = {(token["username"], token["family_id"]) for token in tokens}
+    return {"status": "active",
+            "$or": [{"username": username, "session_id": family_id}
+                    for username, family_id in sessions]}
+
+
+def _orphaned_sessions(now, limit):
+    # anti-join: active sessions without an unexpired refresh token
+    return [{"$match": {"status": "active"}},
+            {"$lookup": {"from": "active_sessions", "localField": "session_id",
+                         "foreignField": "family_id", "as": "tokens"}},
+            {"$match": {"tokens": {"$not": {"$elemMatch": {"expiration_time": {"$gt": now}}}}}},
+            {"$limit": limit},
+            {"$project": {"username": True, "session_id": True}}]
+
+
+def _still_on_sessions(users):
+    # a login since the lookup has moved the user to a new session
+    return {"status": "active",
+            "$or": [{"_id": user["_id"], "session_id": user.get("session_id")}
+                    for user in users]}
+
+
+def _long_token_families(keep, limit):
+    return [{"$match": {"used": True}},
+            {"$group": {"_id": "$family_id", "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": keep}}},
+            {"$limit": limit}]
+
+
+def _trim_token_family(family_id, newest):
+    # the newest used tokens stay, reusing an older one fails as invalid
+    return {"family_id": family_id, "used": True, "_id": {"$nin": newest}}
+
+
+def _long_session_history(keep):
+    return {f"sessions.{keep}": {"$exists": True}}
+
+
+def _trim_session_history(keep):
+    return {"$push": {"sessions": {"$each": [], "$slice": -keep}}}
+
+
+def _refresh_token_writes(token, username, family_id, expiration_time, prune_before, role=None):
+    writes = [InsertOne(_refresh_token_doc(token, username, family_id, expiration_time, role))]
+    if prune_before is not None:
+        writes.insert(0, DeleteMany(_refresh_tokens_of(username, prune_before)))
+    return writes
+
+
+def _mongo_list_projection(fields):
+    projection = {name: True for name in fields if name != "id"}
+    projection["_id"] = True
+    return projection
+
+
+def _mongo_list_row(doc):
+    doc["id"] = str(doc.pop("_id"))
+    return doc
+
+
+def _list_users_query(after):
+    # `_id`s are ObjectIds, or UUIDs for users some earlier versions created,
+    # and MongoDB only compares values of one type: pages follow the username
+    return {"username": {"$gt": after}} if after is not None else {}
+
+
+def _mongo_duplicates(error: BulkWriteError, docs):
+    duplicates = set()
+    for write_error in error.details.get("writeErrors", []):
+        if write_error["code"] != 11000:
+            raise error
+        duplicates.add(docs[write_error["index"]]["username"])
+    return duplicates
+
+
+def _new_mongo_user(username, hashed_password, is_superuser, role="user"):
+    return MongoDBUserDB(username=username,
+                         hashed_password=hashed_password,
+                         is_superuser=is_superuser,
+                         role=role,
+                         created_at=datetime.utcnow())
+
+
+def _set_role(role, is_superuser):
+    return {"$set": {"role": role, "is_superuser": is_superuser}}
+
+
+class MongoUserStore(UserStore):
+    def __init__(self, db):
+        self.db = db
+
+    async def get_user(self, username):
+        return await run_in_threadpool(find_user, self.db, {"username": username})
+
+    async def get_profile(self, username):
+        return await run_in_threadpool(
+            find_user, self.db, {"username": username}, _profile_projection())
+
+    async def create_user(self, username, hashed_password, is_superuser, role="user"):
+        user_data = _new_mongo_user(username, hashed_password, is_superuser, role)
+        await run_in_threadpool(create_user, self.db, user_data)
+        return user_data.dict(exclude={"id"})
+
+    async def activate_session(self, username, session_id):
+        user = await run_in_threadpool(
+            self.db.get_session().users.find_one_and_update, _inactive_user(username),
+            _activate_session(session_id, self.db.config.session_history_limit), {"_id": True})
+        return user is not None
+
+    async def update_password_hash(self, username, old_hash, new_hash):
+        await run_in_threadpool(
+            update_mongo_user, self.db, {"username": username, "hashed_password": old_hash},
+            {"$set": {"hashed_password": new_hash}})
+
+    async def set_status(self, username, status):
+        await run_in_threadpool(update_mongo_user, self.db, {"username": username},
+                                {"$set": {"status": status}})
+
+    async def set_role(self, username, role, is_superuser):
+        result = await run_in_threadpool(
+            self.db.get_session().users.update_one, {"username": username},
+            _set_role(role, is_superuser))
+        return result.matched_count > 0
+
+    @property
+    def refresh_tokens(self):
+        return self.db.get_session().active_sessions
+
+    async def create_refresh_token(self, token, username, family_id, expiration_time,
+                                   prune_before=None, role=None):
+        await run_in_threadpool(self.refresh_tokens.bulk_write, _refresh_token_writes(
+            token, username, family_id, expiration_time, prune_before, role))
+
+    async def use_refresh_token(self, token, now):
+        return await run_in_threadpool(
+            self.refresh_tokens.find_one_and_update, _usable_refresh_token(token, now),
+            {"$set": {"used": True}}, _refresh_projection())
+
+    async def get_refresh_token(self, token):
+        return await run_in_threadpool(
+            self.refresh_tokens.find_one, {"token": token}, _refresh_projection())
+
+    async def delete_refresh_tokens(self, username, expired_before=None, family_id=None):
+        await run_in_threadpool(self.refresh_tokens.delete_many,
+                                _refresh_tokens_of(username, expired_before, family_id))
+
+    def _expire_sessions(self, now, limit):
+        tokens = list(self.refresh_tokens.find(
+            _expired_refresh_tokens(now), {"username": True, "family_id": True})
+            .sort("expiration_time", 1).limit(limit))
+        if not tokens:
+            return [], 0
+        users = self.db.get_session().users
+        query = _active_on_sessions(tokens)
+        expired = [user["username"] for user in users.find(query, {"username": True})]
+        if expired:
+            users.update_many(query, {"$set": {"status": "not active"}})
+        self.refresh_tokens.delete_many({"_id": {"$in": [token["_id"] for token in tokens]}})
+        return expired, len(tokens)
+
+    async def expire_sessions(self, now, limit):
+        return await run_in_threadpool(self._expire_sessions, now, limit)
+
+    def _expire_orphaned_sessions(self, now, limit):
+        users = self.db.get_session().users
+        orphans = list(users.aggregate(_orphaned_sessions(now, limit)))
+        if not orphans:
+            return []
+        query = _still_on_sessions(orphans)
+        expired = [user["username"] for user in users.find(query, {"username": True})]
+        if expired:
+            users.update_many(query, {"$set": {"status": "not active"}})
+        return expired
+
+    async def expire_orphaned_sessions(self, now, limit):
+        return await run_in_threadpool(self._expire_orphaned_sessions, now, limit)
+
+    def _trim_refresh_tokens(self, keep, limit):
+        deleted = 0
+        for family in self.refresh_tokens.aggregate(_long_token_families(keep, limit)):
+            cursor = self.refresh_tokens.find({"family_id": family["_id"], "used": True}, {"_id": True})
+            newest = [token["_id"] for token in cursor.sort("_id", -1).limit(keep)]
+            deleted += self.refresh_tokens.delete_many(
+                _trim_token_family(family["_id"], newest)).deleted_count
+        return deleted
+
+    async def trim_refresh_tokens(self, keep, limit):
+        return await run_in_threadpool(self._trim_refresh_tokens, keep, limit)
+
+    def _trim_session_history(self, keep, limit):
+        users = self.db.get_session().users
+        ids = [user["_id"] for user in users.find(_long_session_history(keep), {"_id": True})
+               .limit(limit)]
+        if ids:
+            users.update_many({"_id": {"$in": ids}}, _trim_session_history(keep))
+        return len(ids)
+
+    async def trim_session_history(self, keep, limit):
+        return await run_in_threadpool(self._trim_session_history, keep, limit)
+
+    list_fields = MONGO_USER_LIST_FIELDS
+    cursor_field = "username"
+
+    def _list_users(self, fields, limit, after):
+        cursor = self.db.get_session().users.find(
+            _list_users_query(after), _mongo_list_projection(fields)).sort("username", 1).limit(limit)
+        return [_mongo_list_row(doc) for doc in cursor]
+
+    async def list_users(self, fields, limit, after=None):
+        return await run_in_threadpool(self._list_users, fields, limit, after)
+
+    def _iter_users(self, fields, batch_size):
+        cursor = self.db.get_session().users.find(
+            {}, _mongo_list_projection(fields), batch_size=batch_size).sort("_id", 1)
+        with cursor:
+            for doc in cursor:
+                yield _mongo_list_row(doc)
+
+    def iter_users(self, fields, batch_size=1000):
+        return iterate_in_threadpool(self._iter_users(fields, batch_size))
+
+    def parse_cursor(self, after):
+        return after
+
+    def _bulk_create_users(self, users):
+        collection = self.db.get_session().users
+        duplicates = {doc["username"] for doc in collection.find(
+            {"username": {"$in": [user["username"] for user in users]}}, {"username": True})}
+        docs = [user_document(_new_mongo_user(**user))
+                for user in users if user["username"] not in duplicates]
+        if docs:
+            try:
+                collection.insert_many(docs, ordered=False)
+            except BulkWriteError as error:
+                duplicates |= _mongo_duplicates(error, docs)
+        return duplicates
+
+    async def bulk_create_users(self, users):
+        return await run_in_threadpool(self._bulk_create_users, users)
+
+
+class MotorUserStore(UserStore):
+    """Motor (asyncio pymongo) implementation."""
+
+    def __init__(self, db):
+        self.db = db
+
+    @property
+    def users(self):
+        return self.db.get_async_session().users
+
+    async def get_user(self, username):
+        return await self.users.find_one({"username": username})
+
+    async def get_profile(self, username):
+        return await self.users.find_one({"username": username}, _profile_projection())
+
+    async def create_user(self, username, hashed_password, is_superuser, role="user"):
+        user_data = _new_mongo_user(username, hashed_password, is_superuser, role)
+        try:
+            await self.users.insert_one(user_document(user_data))
+        except DuplicateKeyError:
+            raise HTTPException(status_code=409, detail="User already exists!")
+        return user_data.dict(exclude={"id"})
+
+    async def activate_session(self, username, session_id):
+        user = await self.users.find_one_and_update(
+            _inactive_user(username),
+            _activate_session(session_id, self.db.config.session_history_limit), {"_id": True})
+        return user is not None
+
+    async def update_password_hash(self, username, old_hash, new_hash):
+        await self.users.update_one({"username": username, "hashed_password": old_hash},
+                                    {"$set": {"hashed_password": new_hash}})
+
+    async def set_status(self, username, status):
+        await self.users.update_one({"username": username}, {"$set": {"status": status}})
+
+    async def set_role(self, username, role, is_superuser):
+        result = await self.users.update_one({"username": username}, _set_role(role, is_superuser))
+        return result.matched_count > 0
+
+    @property
+    def refresh_tokens(self):
+        return self.db.get_async_session().active_sessions
+
+    async def create_refresh_token(self, token, username, family_id, expiration_time,
+                                   prune_before=None, role=None):
+        await self.refresh_tokens.bulk_write(_refresh_token_writes(
+            token, username, family_id, expiration_time, prune_before, role))
+
+    async def use_refresh_token(self, token, now):
+        return await self.refresh_tokens.find_one_and_update(
+            _usable_refresh_token(token, now), {"$set": {"used": True}}, _refresh_projection())
+
+    async def get_refresh_token(self, token):
+        return await self.refresh_tokens.find_one({"token": token}, _refresh_projection())
+
+    async def delete_refresh_tokens(self, username, expired_before=None, family_id=None):
+        await self.refresh_tokens.delete_many(
+            _refresh_tokens_of(username, expired_before, family_id))
+
+    async def expire_sessions(self, now, limit):
+        cursor = self.refresh_tokens.find(
+            _expired_refresh_tokens(now), {"username": True, "family_id": True})
+        tokens = await cursor.sort("expiration_time", 1).to_list(limit)
+        if not tokens:
+            return [], 0
+        query = _active_on_sessions(tokens)
+        expired = [user["username"] async for user in self.users.find(query, {"username": True})]
+        if expired:
+            await self.users.update_many(query, {"$set": {"status": "not active"}})
+        await self.refresh_tokens.delete_many(
+            {"_id": {"$in": [token["_id"] for token in tokens]}})
+        return expired, len(tokens)
+
+    async def expire_orphaned_sessions(self, now, limit):
+        orphans = await self.users.aggregate(_orphaned_sessions(now, limit)).to_list(limit)
+        if not orphans:
+            return []
+        query = _still_on_sessions(orphans)
+        expired = [user["username"] async for user in self.users.find(query, {"username": True})]
+        if expired:
+            await self.users.update_many(query, {"$set": {"status": "not active"}})
+        return expired
+
+    async def trim_refresh_tokens(self, keep, limit):
+        deleted = 0
+        async for family in self.refresh_tokens.aggregate(_long_token_families(keep, limit)):
+            cursor = self.refresh_tokens.find({"family_id": family["_id"], "used": True}, {"_id": True})
+            newest = [token["_id"] for token in await cursor.sort("_id", -1).to_list(keep)]
+            result = await self.refresh_tokens.delete_many(_trim_token_family(family["_id"], newest))
+            deleted += result.deleted_count
+        return deleted
+
+    async def trim_session_history(self, keep, limit):
+        cursor = self.users.find(_long_session_history(keep), {"_id": True})
+        ids = [user["_id"] for user in await cursor.to_list(limit)]
+        if ids:
+            await self.users.update_many({"_id": {"$in": ids}}, _trim_session_history(keep))
+        return len(ids)
+
+    list_fields = MONGO_USER_LIST_FIELDS
+    cursor_field = "username"
+
+    async def list_users(self, fields, limit, after=None):
+        cursor = self.users.find(_list_users_query(after), _mongo_list_projection(fields))
+        cursor = cursor.sort("username", 1).limit(limit)
+        return [_mongo_list_row(doc) async for doc in cursor]
+
+    async def iter_users(self, fields, batch_size=1000):
+        cursor = self.users.find({}, _mongo_list_projection(fields), batch_size=batch_size)
+        async for doc in cursor.sort("_id", 1):
+            yield _mongo_list_row(doc)
+
+    def parse_cursor(self, after):
+        return after
+
+    async def bulk_create_users(self, users):
+        cursor = self.users.find(
+            {"username": {"$in": [user["username"] for user in users]}}, {"username": True})
+        duplicates = {doc["username"] async for doc in cursor}
+        docs = [user_document(_new_mongo_user(**user))
+                for user in users if user["username"] not in duplicates]
+        if docs:
+            try:
+                await self.users.insert_many(docs, ordered=False)
+            except BulkWriteError as error:
+                duplicates |= _mongo_duplicates(error, docs)
+        return duplicates
@@ -1,15 +1,11 @@
 # my_authentication_app/authentication/mongodb_models.py
 from pydantic.v1 import BaseModel, Field
 from uuid import UUID, uuid4
-from .database import db
 from pymongo.errors import DuplicateKeyError
 from fastapi import HTTPException
 from datetime import datetime
 
-# collection = db.get_session().users
-
-# create indexes
-# collection.create_index("username", unique=True)
+# Indexes are created at startup by `schema.SchemaManager`, see `MONGO_INDEXES`
 
 
 class MongoDBUserDB(BaseModel):
@@ -38,11 +34,15 @@ class MongoDBUserDB(BaseModel):
         }
 
 
-def create_user(user_data):
+def user_document(user_data):
+    # `_id` is left to MongoDB, every user document has an ObjectId `_id`
+    return user_data.dict(exclude={"id"})
+
+
+def create_user(db, user_data):
     try:
         collection = db.get_session().users
-        res = collection.insert_one(
-            user_data.dict())
+        res = collection.insert_one(user_document(user_data))
         return res
 
     except DuplicateKeyError:
@@ -52,16 +52,16 @@ def create_user(user_data):
         raise HTTPException(status_code=500, detail="Something went wrong!")
 
 
-def find_user(query):
+def find_user(db, query, projection=None):
     try:
         collection = db.get_session().users
-        res = collection.find_one(query)
+        res = collection.find_one(query, projection)
         return res
     except Exception:
         raise HTTPException(status_code=500, detail="Something went wrong!")
 
 
-def update_mongo_user(query, data):
+def update_mongo_user(db, query, data):
     try:
         collection = db.get_session().users
         collection.update_one(query, data)
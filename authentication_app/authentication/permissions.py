@@ -0,0 +1,45 @@
+# my_authentication_app/authentication/permissions.py
+from functools import lru_cache
+
+# role -> scopes granted to its tokens, `AuthConfig.role_scopes` replaces it
+DEFAULT_ROLE_SCOPES = {
+    "user": ["me"],
+    "admin": ["me", "users:create", "users:read"],
+    "superuser": ["me", "users:create", "users:read", "users:roles", "superuser"],
+}
+
+
+@lru_cache(maxsize=1024)
+def parse_scope_claim(claim: str) -> frozenset:
+    # every token of a role carries the same claim, so this is a dict hit
+    return frozenset(claim.split())
+
+
+class RoleScopes:
+    """Maps a user's role to the scopes embedded in their tokens.
+
+    Scopes are resolved once per role when the mapping is built. Access
+    tokens carry them as a space separated `scope` claim, so a route's
+    `Security(..., scopes=[...])` is checked against the token alone.
+    Superusers (`is_superuser`) always get the "superuser" role.
+    """
+
+    def __init__(self, roles: dict):
+        self.roles = {role: frozenset(scopes) for role, scopes in roles.items()}
+        self.claims = {role: " ".join(sorted(scopes)) for role, scopes in self.roles.items()}
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.role_scopes or DEFAULT_ROLE_SCOPES)
+
+    def role_of(self, user) -> str:
+        if user.get("is_superuser"):
+            return "superuser"
+        return user.get("role") or "user"
+
+    def claim(self, role) -> str:
+        # an unknown role, e.g. one dropped from the config, grants nothing
+        return self.claims.get(role, "")
+
+    def scopes(self, role) -> frozenset:
+        return self.roles.get(role, frozenset())
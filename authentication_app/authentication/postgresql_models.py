@@ -1,5 +1,5 @@
 # my_authentication_app/authentication/postgresql_models.py
-from sqlalchemy import Column, Integer, String, Boolean, DateTime
+from sqlalchemy import Column, Index, Integer, String, Boolean, DateTime, delete, func, insert, select, tuple_, update
 from datetime import datetime
 from sqlalchemy.ext.declarative import declarative_base
 from pydantic.v1 import BaseModel, Field
@@ -9,53 +9,195 @@ Base = declarative_base()
 class SQLUserDB(Base):
     __tablename__ = "users"
     # __table_args__ = {'schema': 'pubic'}
+    __table_args__ = (
+        # not `ix_users_username`, older databases have a non-unique index by that name
+        Index("uq_users_username", "username", unique=True),
+        # login and session checks filter on both
+        Index("ix_users_username_status", "username", "status"),
+        # the sweeper's orphaned session check reads the active users' sessions
+        Index("ix_users_status_session_id", "status", "session_id"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    username = Column(String, index=True)
+    username = Column(String)
     hashed_password = Column(String)
     # active_session = Column(String)
-    session_id = Column(String, unique=True)
+    session_id = Column(String, index=True, unique=True)
     status = Column(String, default='not active')
     created_at = Column(DateTime, default=datetime.utcnow)
     is_superuser = Column(Boolean, default=False)
+    # see `permissions.RoleScopes`, existing rows get the default when the column is added
+    role = Column(String, default="user", server_default="user")
 
 
+# Refresh tokens, one row per issued token. `token` holds the sha256 of the
+# token, `family_id` the session (sid) it belongs to and `used` marks rotated
+# tokens so presenting one again is detected as reuse.
 class ActiveSession(Base):
     __tablename__ = "active_sessions"
 
     id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     token = Column(String, unique=True, index=True)
     username = Column(String, index=True)
-    expiration_time = Column(DateTime)
+    family_id = Column(String, index=True)
+    used = Column(Boolean, default=False, nullable=False)
+    expiration_time = Column(DateTime, index=True)
+    # role the session's tokens are issued for, tokens from before roles are NULL
+    role = Column(String)
 
 
 def invalidate_previous_session(db, username):
     # Find and delete the previous session
-    db_session = db.get_session()
-    previous_session = db_session.query(SQLUserDB).filter(SQLUserDB.username == username).order_by(SQLUserDB.created_at.desc()).first()
-
-    if previous_session:
-        db_session.delete(previous_session)
-        db_session.commit()
-
-def update_pg_user_session(db, username, session, status):
-    db = db.get_session()
-    print(username)
-    user_to_update = db.query(SQLUserDB).filter_by(username=username.strip()).first()
-    if user_to_update:
-        # Update the "active_session" attribute
-        user_to_update.session_id = session
-        user_to_update.status = status
-        db.commit()
-        print(f"Updated active session for user : {username}")
-    else:
-        print(f"User not found: {username}")
+    with db.session_scope() as db_session:
+        previous_session = db_session.query(SQLUserDB).filter(SQLUserDB.username == username).order_by(SQLUserDB.created_at.desc()).first()
 
-    # Close the session
-    db.close()
+        if previous_session:
+            db_session.delete(previous_session)
+            db_session.commit()
+
+def set_pg_user_status(db, username, status):
+    with db.session_scope() as db:
+        db.query(SQLUserDB).filter_by(username=username).update({"status": status})
+        db.commit()
 
 def get_pg_user_session(db, username):
-    db = db.get_session()
-    user = db.query(SQLUserDB).filter_by(username=username).first()
-    db.close()
-    return user
+    with db.session_scope() as db:
+        return db.query(SQLUserDB).filter_by(username=username).first()
+
+def activate_session_stmt(username, session_id):
+    # compare-and-set: only a user without an active session can be activated,
+    # so two concurrent logins cannot both win
+    return update(SQLUserDB)\
+        .where(SQLUserDB.username == username,
+               SQLUserDB.status.is_distinct_from("active"))\
+        .values(session_id=session_id, status="active")\
+        .returning(SQLUserDB.id)
+
+def update_password_hash_stmt(username, old_hash, new_hash):
+    # skipped if the password changed since `old_hash` was read
+    return update(SQLUserDB)\
+        .where(SQLUserDB.username == username,
+               SQLUserDB.hashed_password == old_hash)\
+        .values(hashed_password=new_hash)
+
+def set_role_stmt(username, role, is_superuser):
+    return update(SQLUserDB)\
+        .where(SQLUserDB.username == username)\
+        .values(role=role, is_superuser=is_superuser)\
+        .returning(SQLUserDB.id)
+
+def pg_user_to_dict(user):
+    if user is None:
+        return None
+    return {column.name: getattr(user, column.name) for column in SQLUserDB.__table__.columns}
+
+
+# Refresh token statements, shared by the sync and async stores
+REFRESH_TOKEN_COLUMNS = (ActiveSession.username, ActiveSession.family_id,
+                         ActiveSession.used, ActiveSession.expiration_time, ActiveSession.role)
+
+def insert_refresh_token_stmt(token, username, family_id, expiration_time, role=None):
+    return insert(ActiveSession).values(token=token, username=username, family_id=family_id,
+                                        used=False, expiration_time=expiration_time, role=role)
+
+def use_refresh_token_stmt(token, now):
+    # mark the token used only if it is still unused and unexpired
+    return update(ActiveSession)\
+        .where(ActiveSession.token == token,
+               ActiveSession.used.is_(False),
+               ActiveSession.expiration_time > now)\
+        .values(used=True)\
+        .returning(*REFRESH_TOKEN_COLUMNS)
+
+def get_refresh_token_stmt(token):
+    return select(*REFRESH_TOKEN_COLUMNS).where(ActiveSession.token == token)
+
+def delete_refresh_tokens_stmt(username, expired_before=None, family_id=None):
+    stmt = delete(ActiveSession).where(ActiveSession.username == username)
+    if expired_before is not None:
+        stmt = stmt.where(ActiveSession.expiration_time < expired_before)
+    if family_id is not None:
+        stmt = stmt.where(ActiveSession.family_id == family_id)
+    return stmt
+
+
+# `/me` columns, see `responses.UserProfile`
+SQL_PROFILE_COLUMNS = (SQLUserDB.username, SQLUserDB.is_superuser,
+                       SQLUserDB.status, SQLUserDB.created_at, SQLUserDB.role)
+
+def get_profile_stmt(username):
+    return select(*SQL_PROFILE_COLUMNS).where(SQLUserDB.username == username).limit(1)
+
+# Sweeper statements. Every token of a session shares its expiration_time.
+def expired_refresh_tokens_stmt(now, limit):
+    return select(ActiveSession.id, ActiveSession.username, ActiveSession.family_id)\
+        .where(ActiveSession.expiration_time < now)\
+        .order_by(ActiveSession.expiration_time)\
+        .limit(limit)
+
+def expire_sessions_stmt(sessions):
+    # only users still on the expired session, a newer login is left alone
+    return update(SQLUserDB)\
+        .where(SQLUserDB.status == "active",
+               tuple_(SQLUserDB.username, SQLUserDB.session_id).in_(sessions))\
+        .values(status="not active")\
+        .returning(SQLUserDB.username)
+
+def _live_refresh_token(now):
+    # correlated with the user row of the enclosing statement
+    return select(ActiveSession.id).where(ActiveSession.family_id == SQLUserDB.session_id,
+                                          ActiveSession.expiration_time > now)
+
+def orphaned_sessions_stmt(now, limit):
+    # anti-join: active sessions without an unexpired refresh token
+    return select(SQLUserDB.id)\
+        .where(SQLUserDB.status == "active", ~_live_refresh_token(now).exists())\
+        .limit(limit)
+
+def expire_orphaned_sessions_stmt(ids, now):
+    # checked again, a login since the select has its token
+    return update(SQLUserDB)\
+        .where(SQLUserDB.id.in_(ids),
+               SQLUserDB.status == "active",
+               ~_live_refresh_token(now).exists())\
+        .values(status="not active")\
+        .returning(SQLUserDB.username)
+
+def delete_refresh_tokens_by_id_stmt(ids):
+    return delete(ActiveSession).where(ActiveSession.id.in_(ids))
+
+def long_token_families_stmt(keep, limit):
+    return select(ActiveSession.family_id)\
+        .where(ActiveSession.used.is_(True))\
+        .group_by(ActiveSession.family_id)\
+        .having(func.count() > keep)\
+        .limit(limit)
+
+def trim_token_family_stmt(family_id, keep):
+    # the newest `keep` used tokens stay, reusing an older one fails as invalid
+    newest = select(ActiveSession.id)\
+        .where(ActiveSession.family_id == family_id, ActiveSession.used.is_(True))\
+        .order_by(ActiveSession.id.desc())\
+        .limit(keep)
+    return delete(ActiveSession)\
+        .where(ActiveSession.family_id == family_id,
+               ActiveSession.used.is_(True),
+               ActiveSession.id.not_in(newest))
+
+
+# Columns `/all` may return, secrets are never selectable
+SQL_USER_LIST_FIELDS = ("id", "username", "is_superuser", "status", "created_at", "role")
+
+def list_users_stmt(fields, after=None, limit=None):
+    # keyset pagination on the primary key
+    columns = [SQLUserDB.__table__.c[name] for name in fields]
+    stmt = select(*columns).order_by(SQLUserDB.id)
+    if after is not None:
+        stmt = stmt.where(SQLUserDB.id > after)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt
+
+
+def existing_usernames_stmt(usernames):
+    return select(SQLUserDB.username).where(SQLUserDB.username.in_(usernames))
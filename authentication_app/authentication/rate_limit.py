@@ -0,0 +1,190 @@
+# my_authentication_app/authentication/rate_limit.py
+import math
+import threading
+import time
+
+from starlette.concurrency import run_in_threadpool
+
+
+class RateLimitBackend:
+    """Storage for sliding-window counters.
+
+    A counter is kept per key and fixed window (`window_index`); the sliding
+    estimate is derived from the current and the previous window only, so a
+    key costs two integers however many attempts it sees.
+    """
+
+    async def incr(self, key, window_index, window):
+        """Count one attempt, returns (previous, current) window counts."""
+        raise NotImplementedError
+
+    async def decr(self, key, window_index):
+        raise NotImplementedError
+
+    async def reset(self, key, window_index):
+        raise NotImplementedError
+
+
+class InMemoryRateLimitBackend(RateLimitBackend):
+    # key -> [window_index, previous_count, current_count]
+    def __init__(self, sweep_every: int = 1024):
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._sweep_every = sweep_every
+        self._hits = 0
+
+    async def incr(self, key, window_index, window):
+        with self._lock:
+            self._hits += 1
+            if self._hits % self._sweep_every == 0:
+                self._sweep(window_index)
+            counter = self._counters.get(key)
+            if counter is None or counter[0] < window_index - 1:
+                counter = self._counters[key] = [window_index, 0, 0]
+            elif counter[0] == window_index - 1:
+                counter[:] = [window_index, counter[2], 0]
+            counter[2] += 1
+            return counter[1], counter[2]
+
+    async def decr(self, key, window_index):
+        with self._lock:
+            counter = self._counters.get(key)
+            if counter is not None and counter[0] == window_index and counter[2] > 0:
+                counter[2] -= 1
+
+    async def reset(self, key, window_index):
+        with self._lock:
+            self._counters.pop(key, None)
+
+    def _sweep(self, window_index):
+        # keys idle for two windows no longer affect any estimate
+        stale = [key for key, counter in self._counters.items()
+                 if counter[0] < window_index - 1]
+        for key in stale:
+            del self._counters[key]
+
+    def __len__(self):
+        return len(self._counters)
+
+
+class RedisRateLimitBackend(RateLimitBackend):
+    """Counters shared by every worker, one expiring key per key and window."""
+
+    def __init__(self, client, key_prefix: str = "auth:ratelimit:"):
+        self.client = client
+        self.key_prefix = key_prefix
+
+    def _key(self, key, window_index):
+        return f"{self.key_prefix}{key}:{window_index}"
+
+    def _incr(self, key, window_index, window):
+        pipe = self.client.pipeline()
+        pipe.incr(self._key(key, window_index))
+        pipe.expire(self._key(key, window_index), int(window * 2) + 1)
+        pipe.get(self._key(key, window_index - 1))
+        current, _, previous = pipe.execute()
+        return int(previous or 0), int(current)
+
+    async def incr(self, key, window_index, window):
+        return await run_in_threadpool(self._incr, key, window_index, window)
+
+    async def decr(self, key, window_index):
+        await run_in_threadpool(self.client.decr, self._key(key, window_index))
+
+    async def reset(self, key, window_index):
+        # only the current and previous windows count towards the estimate
+        await run_in_threadpool(self.client.delete, self._key(key, window_index),
+                                self._key(key, window_index - 1))
+
+
+class LoginRateLimiter:
+    """Sliding-window limits on login attempts per username and per client IP.
+
+    `hit` counts an attempt against both keys and returns 0 when it may go
+    ahead, or the seconds to wait before the next attempt would be allowed.
+    Rejected attempts are not counted, so a throttled client is let back in
+    once the window slides past its earlier attempts. Limiters sharing a
+    backend keep their counters apart with `key_prefix`.
+    """
+
+    def __init__(self, backend: RateLimitBackend = None, window: float = 300,
+                 max_attempts_per_user: int = 10, max_attempts_per_ip: int = 50,
+                 enabled: bool = True, key_prefix: str = ""):
+        # an empty in-memory backend is falsy, it has a length
+        self.backend = InMemoryRateLimitBackend() if backend is None else backend
+        self.window = window
+        self.max_attempts_per_user = max_attempts_per_user
+        self.max_attempts_per_ip = max_attempts_per_ip
+        self.enabled = enabled
+        self.key_prefix = key_prefix
+        self.rejected = 0
+
+    @classmethod
+    def from_config(cls, config, backend: RateLimitBackend = None, key_prefix: str = ""):
+        return cls(get_rate_limit_backend(config) if backend is None else backend,
+                   window=config.login_rate_window,
+                   max_attempts_per_user=config.login_max_attempts_per_user,
+                   max_attempts_per_ip=config.login_max_attempts_per_ip,
+                   enabled=config.login_rate_limit_enabled,
+                   key_prefix=key_prefix)
+
+    def _limits(self, username, client_ip):
+        limits = [(f"{self.key_prefix}user:{username}", self.max_attempts_per_user)]
+        if client_ip:
+            limits.append((f"{self.key_prefix}ip:{client_ip}", self.max_attempts_per_ip))
+        return limits
+
+    def _retry_after(self, previous, current, limit, elapsed):
+        # seconds until previous * (1 - t / window) + current drops to limit - 1,
+        # i.e. until one more attempt fits
+        allowed = limit - 1
+        if current <= allowed:
+            needed = 1 - (allowed - current) / previous
+            return max(needed * self.window - elapsed, 0)
+        needed = 1 - allowed / current
+        return (self.window - elapsed) + needed * self.window
+
+    async def hit(self, username, client_ip=None):
+        if not self.enabled:
+            return 0
+        now = time.time()
+        window_index = int(now // self.window)
+        elapsed = now - window_index * self.window
+        counted = []
+        retry_after = None
+        for key, limit in self._limits(username, client_ip):
+            previous, current = await self.backend.incr(key, window_index, self.window)
+            counted.append(key)
+            estimate = previous * (1 - elapsed / self.window) + current
+            if estimate > limit:
+                retry_after = self._retry_after(previous, current - 1, limit, elapsed)
+                break
+        if retry_after is None:
+            return 0
+        for key in counted:
+            await self.backend.decr(key, window_index)
+        self.rejected += 1
+        return max(math.ceil(retry_after), 1)
+
+    async def reset(self, username):
+        # a successful login clears the user's failures, not the client IP's
+        await self.backend.reset(f"{self.key_prefix}user:{username}",
+                                 int(time.time() // self.window))
+
+    def stats(self):
+        stats = {"enabled": self.enabled, "rejected": self.rejected}
+        if isinstance(self.backend, InMemoryRateLimitBackend):
+            stats["tracked_keys"] = len(self.backend)
+        return stats
+
+
+def get_rate_limit_backend(config) -> RateLimitBackend:
+    if config.login_rate_limit_backend == "memory":
+        return InMemoryRateLimitBackend()
+    elif config.login_rate_limit_backend == "redis":
+        import redis
+
+        return RedisRateLimitBackend(redis.Redis.from_url(config.redis_url),
+                                     key_prefix=config.login_rate_limit_prefix)
+    else:
+        raise ValueError("Invalid rate limit backend. Please choose 'memory' or 'redis'.")
@@ -0,0 +1,39 @@
+# my_authentication_app/authentication/responses.py
+from datetime import datetime
+from typing import List, Optional, Union
+
+from pydantic import BaseModel
+
+# Response bodies. Stores select only these columns, and anything else a
+# store hands back (password hashes, session ids) is dropped on validation.
+
+# Columns of `UserProfile`
+PROFILE_FIELDS = ("username", "is_superuser", "status", "created_at", "role")
+
+
+class UserProfile(BaseModel):
+    username: str
+    is_superuser: bool = False
+    status: Optional[str] = None
+    created_at: Optional[datetime] = None
+    role: Optional[str] = None
+
+
+class UserSummary(BaseModel):
+    # one `/all` row, only the requested `fields` are set
+    id: Union[int, str]
+    username: Optional[str] = None
+    is_superuser: Optional[bool] = None
+    status: Optional[str] = None
+    created_at: Optional[datetime] = None
+    role: Optional[str] = None
+
+
+class UserPage(BaseModel):
+    users: List[UserSummary]
+    next: Optional[str] = None
+
+
+class LogoutResponse(BaseModel):
+    user: Optional[UserProfile] = None
+    mssg: str
@@ -0,0 +1,235 @@
+# my_authentication_app/authentication/schema.py
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Indexes every MongoDB deployment needs, per collection
+MONGO_INDEXES = {
+    "users": [
+        {"name": "username_unique", "keys": [("username", 1)], "unique": True},
+        # login and session checks filter on both
+        {"name": "username_status", "keys": [("username", 1), ("status", 1)]},
+        {"name": "session_id", "keys": [("session_id", 1)]},
+        # the sweeper's orphaned session check reads the active users' sessions
+        {"name": "status_session_id", "keys": [("status", 1), ("session_id", 1)]},
+    ],
+    "active_sessions": [
+        {"name": "token_unique", "keys": [("token", 1)], "unique": True},
+        {"name": "username", "keys": [("username", 1)]},
+        {"name": "family_id", "keys": [("family_id", 1)]},
+        # expired tokens are deleted by `SessionSweeper` once their session is
+        # ended, a TTL index would drop them before it sees them
+        {"name": "expiration_time", "keys": [("expiration_time", 1)]},
+    ],
+}
+
+
+class SchemaManager:
+    """Creates and verifies the tables and indexes of the configured backend.
+
+    Indexes are compared by their columns (and uniqueness / TTL), not by
+    name, so ones created by hand or by an older version still count.
+    Columns added to an existing table since it was created are added too.
+    `ensure()` creates what is missing; what cannot be created, e.g. a unique
+    index over duplicate usernames, is reported instead of failing startup.
+    For a missing unique index the number of duplicated values is reported
+    under `duplicates`.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.created = []
+        self.missing = []
+        self.duplicates = {}
+
+    def run(self, mode: str = "create"):
+        if mode == "off":
+            return self.report()
+        if mode not in ("create", "verify"):
+            raise ValueError("Invalid schema mode. Please choose 'create', 'verify' or 'off'.")
+        self.created, self.missing, self.duplicates = [], [], {}
+        if self.db.config.use_database == "postgresql":
+            self._run_sql(create=mode == "create")
+        elif self.db.config.use_database == "mongodb":
+            self._run_mongo(create=mode == "create")
+        else:
+            raise ValueError("Invalid database type. Please choose 'postgresql' or 'mongodb'.")
+        for name in self.created:
+            logger.info("Created %s", name)
+        for name in self.missing:
+            logger.warning("Missing %s", name)
+        for name, count in self.duplicates.items():
+            logger.warning("%s duplicated values in %s", count, name)
+        return self.report()
+
+    def ensure(self):
+        return self.run("create")
+
+    def verify(self):
+        return self.run("verify")
+
+    def report(self):
+        return {"created": list(self.created), "missing": list(self.missing),
+                "duplicates": dict(self.duplicates)}
+
+    # PostgreSQL
+
+    def _run_sql(self, create):
+        from sqlalchemy import inspect
+        from sqlalchemy.exc import SQLAlchemyError
+
+        from .postgresql_models import Base
+
+        if self.db.engine is None:
+            self.db.connect()
+        engine = self.db.engine
+        inspector = inspect(engine)
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                if self._try(create, SQLAlchemyError, f"table {table.name}", table.create, engine):
+                    # a new table comes with all of its indexes
+                    continue
+                self.missing.extend(_describe_sql(index) for index in table.indexes)
+                continue
+            columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns:
+                    self._try(create, SQLAlchemyError, f"column {column.name} on {table.name}",
+                              _add_sql_column, engine, column)
+            existing = _existing_sql_indexes(inspector, table.name)
+            for index in table.indexes:
+                unique = existing.get(tuple(column.name for column in index.columns))
+                if unique or (unique is not None and not index.unique):
+                    continue
+                if not self._try(create, SQLAlchemyError, _describe_sql(index),
+                                 index.create, engine) and index.unique:
+                    self._count_duplicates(_columns_of(index), _count_sql_duplicates,
+                                           engine, index)
+
+    # MongoDB
+
+    def _run_mongo(self, create):
+        from pymongo.errors import PyMongoError
+
+        database = self.db.get_session()
+        for collection_name, specs in MONGO_INDEXES.items():
+            collection = database[collection_name]
+            existing = _existing_mongo_indexes(collection)
+            for spec in specs:
+                if _mongo_satisfied(existing, spec):
+                    continue
+                options = {key: value for key, value in spec.items() if key != "keys"}
+                if not self._try(create, PyMongoError, _describe_mongo(collection_name, spec),
+                                 collection.create_index, spec["keys"], **options) \
+                        and spec.get("unique"):
+                    fields = ", ".join(field for field, _ in spec["keys"])
+                    self._count_duplicates(f"{collection_name} ({fields})",
+                                           _count_mongo_duplicates, collection, spec["keys"])
+
+    def _count_duplicates(self, name, fn, *args):
+        try:
+            count = fn(*args)
+        except Exception:
+            logger.exception("Could not count duplicates in %s", name)
+            return
+        if count:
+            self.duplicates[name] = count
+
+    def _try(self, create, errors, description, fn, *args, **kwargs):
+        if not create:
+            self.missing.append(description)
+            return False
+        try:
+            fn(*args, **kwargs)
+        except errors as e:
+            logger.error("Could not create %s: %s", description, e)
+            self.missing.append(description)
+            return False
+        self.created.append(description)
+        return True
+
+
+def _describe_sql(index):
+    columns = ", ".join(column.name for column in index.columns)
+    kind = "unique index" if index.unique else "index"
+    return f"{kind} {index.name} on {index.table.name} ({columns})"
+
+
+def _columns_of(index):
+    return f"{index.table.name} ({', '.join(column.name for column in index.columns)})"
+
+
+def _count_sql_duplicates(engine, index):
+    # values held by more than one row, each blocks the unique index
+    from sqlalchemy import func, select
+
+    columns = list(index.columns)
+    duplicated = select(*columns).group_by(*columns).having(func.count() > 1).subquery()
+    with engine.connect() as connection:
+        return connection.execute(select(func.count()).select_from(duplicated)).scalar()
+
+
+def _add_sql_column(engine, column):
+    from sqlalchemy.schema import CreateColumn
+
+    # the column's server default fills in the existing rows
+    table = engine.dialect.identifier_preparer.format_table(column.table)
+    definition = CreateColumn(column).compile(dialect=engine.dialect)
+    with engine.begin() as connection:
+        connection.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {definition}")
+
+
+def _existing_sql_indexes(inspector, table_name):
+    # columns -> unique, a unique constraint is backed by a unique index
+    existing = {}
+    for index in inspector.get_indexes(table_name):
+        columns = tuple(index["column_names"])
+        existing[columns] = existing.get(columns, False) or bool(index["unique"])
+    for constraint in inspector.get_unique_constraints(table_name):
+        existing[tuple(constraint["column_names"])] = True
+    primary_key = inspector.get_pk_constraint(table_name)["constrained_columns"]
+    if primary_key:
+        existing[tuple(primary_key)] = True
+    return existing
+
+
+def _describe_mongo(collection_name, spec):
+    fields = ", ".join(field for field, _ in spec["keys"])
+    if spec.get("unique"):
+        kind = "unique index"
+    elif "expireAfterSeconds" in spec:
+        kind = "TTL index"
+    else:
+        kind = "index"
+    return f"{kind} {spec['name']} on {collection_name} ({fields})"
+
+
+def _count_mongo_duplicates(collection, keys):
+    group = {field.replace(".", "_"): f"${field}" for field, _ in keys}
+    result = list(collection.aggregate([
+        {"$group": {"_id": group, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+        {"$count": "duplicated"}]))
+    return result[0]["duplicated"] if result else 0
+
+
+def _existing_mongo_indexes(collection):
+    return [
+        {"keys": [(field, direction) for field, direction in info["key"]],
+         "unique": info.get("unique", False),
+         "expireAfterSeconds": info.get("expireAfterSeconds")}
+        for info in collection.index_information().values()
+    ]
+
+
+def _mongo_satisfied(existing, spec):
+    for index in existing:
+        if index["keys"] != spec["keys"]:
+            continue
+        if spec.get("unique") and not index["unique"]:
+            continue
+        # a TTL index deletes documents, it does not stand in for a plain one
+        if index["expireAfterSeconds"] != spec.get("expireAfterSeconds"):
+            continue
+        return True
+    return False
@@ -0,0 +1,135 @@
+# my_authentication_app/authentication/session_cache.py
+import threading
+import time
+from collections import OrderedDict
+
+
+class CachedSession:
+    __slots__ = ("active", "user", "expires_at")
+
+    def __init__(self, active, user, expires_at):
+        self.active = active
+        self.user = user
+        self.expires_at = expires_at
+
+
+class SessionCache:
+    """Per-process TTL/LRU cache of session state keyed by (username, session id).
+
+    A user has one current session: activating a session drops the user's
+    other cached sessions, whose tokens then miss once and are cached inactive
+    from the database, and revoking the user marks all of them inactive.
+    So a user keeps a handful of entries however often they log in.
+    The `/me` profile is cached per user next to it and dropped on every state
+    change. A `maxsize` of 0 disables the cache.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._by_user = {}
+        self._profiles = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(maxsize=config.session_cache_size if config.session_cache_enabled else 0,
+                   ttl=config.session_cache_ttl)
+
+    def get(self, username, session_id):
+        key = (username, session_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, username, session_id, active, user=None):
+        if self.maxsize <= 0:
+            return
+        key = (username, session_id)
+        with self._lock:
+            self._entries[key] = CachedSession(active, user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            self._by_user.setdefault(username, set()).add(session_id)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def get_profile(self, username):
+        with self._lock:
+            cached = self._profiles.get(username)
+            if cached is None or cached[0] < time.monotonic():
+                self._profiles.pop(username, None)
+                self.misses += 1
+                return None
+            self._profiles.move_to_end(username)
+            self.hits += 1
+            return cached[1]
+
+    def put_profile(self, username, profile):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._profiles[username] = (time.monotonic() + self.ttl, profile)
+            self._profiles.move_to_end(username)
+            while len(self._profiles) > self.maxsize:
+                self._profiles.popitem(last=False)
+                self.evictions += 1
+
+    def _set_user_state(self, username, active):
+        self._profiles.pop(username, None)
+        for session_id in self._by_user.get(username, ()):
+            self._entries[(username, session_id)].active = active
+
+    def activate(self, username, session_id, user=None):
+        self.invalidate_user(username)
+        self.put(username, session_id, True, user)
+
+    def revoke_user(self, username):
+        with self._lock:
+            self._set_user_state(username, False)
+
+    def invalidate_user(self, username):
+        with self._lock:
+            self._profiles.pop(username, None)
+            for session_id in list(self._by_user.get(username, ())):
+                self._remove((username, session_id))
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        username, session_id = key
+        sessions = self._by_user.get(username)
+        if sessions is not None:
+            sessions.discard(session_id)
+            if not sessions:
+                del self._by_user[username]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+            self._profiles.clear()
+
+    def stats(self):
+        with self._lock:
+            size = len(self._entries) + len(self._profiles)
+        lookups = self.hits + self.misses
+        return {
+            "size": size,
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,195 @@
+# my_authentication_app/authentication/session_store.py
+import json
+import threading
+import time
+import uuid
+
+from starlette.concurrency import run_in_threadpool
+
+
+class SessionStore:
+    """Session state shared between workers.
+
+    Revocations and activations are broadcast to every worker, and each worker
+    keeps a local revocation set so `is_revoked` is a dict lookup on the hot
+    path. Session status is stored per user, so revocations are keyed by
+    username. An entry expires after `revocation_ttl` seconds, the refresh
+    token lifetime, when no token of the revoked session is accepted anymore.
+    """
+
+    def __init__(self, revocation_ttl: float = 3600):
+        self.revocation_ttl = revocation_ttl
+        self.worker_id = uuid.uuid4().hex
+        self._revoked = {}
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback):
+        # callback(event) is called for events published by other workers
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def is_revoked(self, username):
+        revoked_at = self._revoked.get(username)
+        if revoked_at is None:
+            return False
+        if time.monotonic() - revoked_at > self.revocation_ttl:
+            with self._lock:
+                self._revoked.pop(username, None)
+            return False
+        return True
+
+    def _revoke(self, username, now):
+        # kept in revocation order, so expired entries are dropped from the
+        # front instead of waiting for a lookup that may never come
+        self._revoked.pop(username, None)
+        self._revoked[username] = now
+        while True:
+            name, revoked_at = next(iter(self._revoked.items()))
+            if now - revoked_at <= self.revocation_ttl:
+                break
+            del self._revoked[name]
+
+    def revoked_count(self):
+        return len(self._revoked)
+
+    def _apply(self, event):
+        with self._lock:
+            if event["type"] == "revoke":
+                self._revoke(event["username"], time.monotonic())
+            elif event["type"] == "activate":
+                self._revoked.pop(event["username"], None)
+        if event.get("origin") != self.worker_id:
+            for callback in self._subscribers:
+                callback(event)
+
+    def _event(self, type, username, session_id=None):
+        return {"type": type, "username": username,
+                "session_id": session_id, "origin": self.worker_id}
+
+    async def publish_revocation(self, username, session_id=None):
+        raise NotImplementedError
+
+    async def publish_activation(self, username, session_id=None):
+        raise NotImplementedError
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class InMemoryBroker:
+    """Delivers events between in-memory stores living in the same process."""
+
+    def __init__(self):
+        self.stores = []
+
+    def publish(self, event):
+        for store in list(self.stores):
+            store._apply(event)
+
+
+class InMemorySessionStore(SessionStore):
+    def __init__(self, broker: InMemoryBroker = None, revocation_ttl: float = 3600):
+        super().__init__(revocation_ttl)
+        self.broker = broker or InMemoryBroker()
+        self.broker.stores.append(self)
+
+    async def publish_revocation(self, username, session_id=None):
+        self.broker.publish(self._event("revoke", username, session_id))
+
+    async def publish_activation(self, username, session_id=None):
+        self.broker.publish(self._event("activate", username, session_id))
+
+    def stop(self):
+        if self in self.broker.stores:
+            self.broker.stores.remove(self)
+
+
+class RedisSessionStore(SessionStore):
+    """Redis backed store, works with any redis-py compatible client.
+
+    Revocations are kept as expiring keys so a worker that starts later can
+    load the current set, and every change is announced on a pub/sub channel
+    that a background thread applies to the local set.
+    """
+
+    def __init__(self, client, channel: str = "auth:sessions",
+                 key_prefix: str = "auth:revoked:", revocation_ttl: float = 3600):
+        super().__init__(revocation_ttl)
+        self.client = client
+        self.channel = channel
+        self.key_prefix = key_prefix
+        self._pubsub = None
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(self.channel)
+        for key in self.client.scan_iter(match=self.key_prefix + "*"):
+            if isinstance(key, bytes):
+                key = key.decode()
+            self._apply({"type": "revoke", "username": key[len(self.key_prefix):]})
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._listen, name="session-store-listener", daemon=True)
+        self._thread.start()
+
+    def _listen(self):
+        while not self._stopping.is_set():
+            message = self._pubsub.get_message(timeout=1.0)
+            if message and message["type"] == "message":
+                event = json.loads(message["data"])
+                # our own events were applied when published
+                if event.get("origin") != self.worker_id:
+                    self._apply(event)
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self._pubsub is not None:
+            self._pubsub.close()
+            self._pubsub = None
+
+    def _publish(self, event):
+        if event["type"] == "revoke":
+            self.client.set(self.key_prefix + event["username"], 1,
+                            ex=int(self.revocation_ttl))
+        else:
+            self.client.delete(self.key_prefix + event["username"])
+        # apply locally right away, the listener skips our own echo
+        self._apply(event)
+        self.client.publish(self.channel, json.dumps(event))
+
+    async def publish_revocation(self, username, session_id=None):
+        await run_in_threadpool(self._publish, self._event("revoke", username, session_id))
+
+    async def publish_activation(self, username, session_id=None):
+        await run_in_threadpool(self._publish, self._event("activate", username, session_id))
+
+
+def get_session_store(config) -> SessionStore:
+    # a revoked session's refresh tokens, and its access tokens once expired
+    # (logout accepts them), stay usable until the session would have ended
+    revocation_ttl = config.refresh_token_expire_days * 86400
+    if config.session_store == "memory":
+        return InMemorySessionStore(revocation_ttl=revocation_ttl)
+    elif config.session_store == "redis":
+        import redis
+
+        return RedisSessionStore(redis.Redis.from_url(config.redis_url),
+                                 channel=config.session_channel,
+                                 key_prefix=config.session_key_prefix,
+                                 revocation_ttl=revocation_ttl)
+    else:
+        raise ValueError("Invalid session store. Please choose 'memory' or 'redis'.")
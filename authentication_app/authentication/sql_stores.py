@@ -0,0 +1,350 @@
+# my_authentication_app/authentication/sql_stores.py
+from fastapi import HTTPException
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+
+from .postgresql_models import (SQLUserDB,
+                                SQL_USER_LIST_FIELDS,
+                                get_profile_stmt,
+                                list_users_stmt,
+                                existing_usernames_stmt,
+                                activate_session_stmt,
+                                update_password_hash_stmt,
+                                set_role_stmt,
+                                insert_refresh_token_stmt,
+                                use_refresh_token_stmt,
+                                get_refresh_token_stmt,
+                                delete_refresh_tokens_stmt,
+                                expired_refresh_tokens_stmt,
+                                expire_sessions_stmt,
+                                orphaned_sessions_stmt,
+                                expire_orphaned_sessions_stmt,
+                                delete_refresh_tokens_by_id_stmt,
+                                long_token_families_stmt,
+                                trim_token_family_stmt,
+                                get_pg_user_session,
+                                set_pg_user_status,
+                                pg_user_to_dict)
+from .stores import UserStore
+
+
+def _parse_sql_cursor(after):
+    try:
+        return int(after)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+class SQLUserStore(UserStore):
+    def __init__(self, db):
+        self.db = db
+
+    def _get_user(self, username):
+        return pg_user_to_dict(get_pg_user_session(self.db, username))
+
+    async def get_user(self, username):
+        return await run_in_threadpool(self._get_user, username)
+
+    def _first(self, stmt):
+        with self.db.session_scope() as session:
+            row = session.execute(stmt).mappings().first()
+            return dict(row) if row else None
+
+    async def get_profile(self, username):
+        return await run_in_threadpool(self._first, get_profile_stmt(username))
+
+    def _create_user(self, username, hashed_password, is_superuser, role="user"):
+        db_user = SQLUserDB(username=username,
+                            hashed_password=hashed_password,
+                            is_superuser=is_superuser,
+                            role=role)
+        with self.db.session_scope() as session:
+            session.add(db_user)
+            try:
+                session.commit()
+            except IntegrityError:
+                raise HTTPException(status_code=409, detail="User already exists!")
+            session.refresh(db_user)
+            return pg_user_to_dict(db_user)
+
+    async def create_user(self, username, hashed_password, is_superuser, role="user"):
+        return await run_in_threadpool(
+            self._create_user, username, hashed_password, is_superuser, role)
+
+    async def activate_session(self, username, session_id):
+        row = await run_in_threadpool(
+            self._execute, activate_session_stmt(username, session_id), True)
+        return row is not None
+
+    async def update_password_hash(self, username, old_hash, new_hash):
+        await run_in_threadpool(
+            self._execute, update_password_hash_stmt(username, old_hash, new_hash))
+
+    async def set_status(self, username, status):
+        await run_in_threadpool(set_pg_user_status, self.db, username, status)
+
+    async def set_role(self, username, role, is_superuser):
+        row = await run_in_threadpool(
+            self._execute, set_role_stmt(username, role, is_superuser), True)
+        return row is not None
+
+    def _execute(self, stmt, first=False):
+        with self.db.session_scope() as session:
+            result = session.execute(stmt)
+            row = result.mappings().first() if first else None
+            session.commit()
+            return dict(row) if row else None
+
+    def _execute_all(self, stmts):
+        # one checkout and one transaction for several statements
+        with self.db.session_scope() as session:
+            for stmt in stmts:
+                session.execute(stmt)
+            session.commit()
+
+    async def create_refresh_token(self, token, username, family_id, expiration_time,
+                                   prune_before=None, role=None):
+        stmts = [insert_refresh_token_stmt(token, username, family_id, expiration_time, role)]
+        if prune_before is not None:
+            stmts.insert(0, delete_refresh_tokens_stmt(username, prune_before))
+        await run_in_threadpool(self._execute_all, stmts)
+
+    async def use_refresh_token(self, token, now):
+        return await run_in_threadpool(self._execute, use_refresh_token_stmt(token, now), True)
+
+    async def get_refresh_token(self, token):
+        return await run_in_threadpool(self._execute, get_refresh_token_stmt(token), True)
+
+    async def delete_refresh_tokens(self, username, expired_before=None, family_id=None):
+        await run_in_threadpool(
+            self._execute, delete_refresh_tokens_stmt(username, expired_before, family_id))
+
+    def _expire_sessions(self, now, limit):
+        # one transaction: deactivate the sessions, then drop their tokens
+        with self.db.session_scope() as session:
+            tokens = session.execute(expired_refresh_tokens_stmt(now, limit)).all()
+            if not tokens:
+                return [], 0
+            sessions = list({(token.username, token.family_id) for token in tokens})
+            expired = list(session.scalars(expire_sessions_stmt(sessions)))
+            session.execute(delete_refresh_tokens_by_id_stmt([token.id for token in tokens]))
+            session.commit()
+            return expired, len(tokens)
+
+    async def expire_sessions(self, now, limit):
+        return await run_in_threadpool(self._expire_sessions, now, limit)
+
+    def _expire_orphaned_sessions(self, now, limit):
+        with self.db.session_scope() as session:
+            ids = list(session.scalars(orphaned_sessions_stmt(now, limit)))
+            if not ids:
+                return []
+            expired = list(session.scalars(expire_orphaned_sessions_stmt(ids, now)))
+            session.commit()
+            return expired
+
+    async def expire_orphaned_sessions(self, now, limit):
+        return await run_in_threadpool(self._expire_orphaned_sessions, now, limit)
+
+    def _trim_refresh_tokens(self, keep, limit):
+        with self.db.session_scope() as session:
+            deleted = 0
+            for family_id in session.scalars(long_token_families_stmt(keep, limit)).all():
+                deleted += session.execute(trim_token_family_stmt(family_id, keep)).rowcount
+            session.commit()
+            return deleted
+
+    async def trim_refresh_tokens(self, keep, limit):
+        return await run_in_threadpool(self._trim_refresh_tokens, keep, limit)
+
+    list_fields = SQL_USER_LIST_FIELDS
+
+    def _list_users(self, fields, limit, after):
+        with self.db.session_scope() as session:
+            return [dict(row) for row in
+                    session.execute(list_users_stmt(fields, after, limit)).mappings()]
+
+    async def list_users(self, fields, limit, after=None):
+        return await run_in_threadpool(self._list_users, fields, limit, after)
+
+    def _iter_users(self, fields, batch_size):
+        with self.db.session_scope() as session:
+            stmt = list_users_stmt(fields).execution_options(yield_per=batch_size)
+            for row in session.execute(stmt).mappings():
+                yield dict(row)
+
+    def iter_users(self, fields, batch_size=1000):
+        return iterate_in_threadpool(self._iter_users(fields, batch_size))
+
+    def parse_cursor(self, after):
+        return _parse_sql_cursor(after)
+
+    def _bulk_create_users(self, users):
+        with self.db.session_scope() as session:
+            duplicates = set(session.scalars(
+                existing_usernames_stmt([user["username"] for user in users])))
+            rows = [user for user in users if user["username"] not in duplicates]
+            if not rows:
+                return duplicates
+            try:
+                # executemany, batched into multi-row INSERTs by SQLAlchemy
+                session.execute(insert(SQLUserDB), rows)
+                session.commit()
+            except IntegrityError:
+                # lost a race with a concurrent signup, find the offenders one by one
+                session.rollback()
+                for row in rows:
+                    try:
+                        session.execute(insert(SQLUserDB), [row])
+                        session.commit()
+                    except IntegrityError:
+                        session.rollback()
+                        duplicates.add(row["username"])
+            return duplicates
+
+    async def bulk_create_users(self, users):
+        return await run_in_threadpool(self._bulk_create_users, users)
+
+
+class AsyncSQLUserStore(UserStore):
+    """SQLAlchemy `AsyncSession` over asyncpg."""
+
+    def __init__(self, db):
+        self.db = db
+
+    async def get_user(self, username):
+        async with self.db.async_session_scope() as session:
+            result = await session.execute(
+                select(SQLUserDB).where(SQLUserDB.username == username).limit(1))
+            return pg_user_to_dict(result.scalars().first())
+
+    async def get_profile(self, username):
+        async with self.db.async_session_scope() as session:
+            row = (await session.execute(get_profile_stmt(username))).mappings().first()
+            return dict(row) if row else None
+
+    async def create_user(self, username, hashed_password, is_superuser, role="user"):
+        db_user = SQLUserDB(username=username,
+                            hashed_password=hashed_password,
+                            is_superuser=is_superuser,
+                            role=role)
+        async with self.db.async_session_scope() as session:
+            session.add(db_user)
+            try:
+                await session.commit()
+            except IntegrityError:
+                raise HTTPException(status_code=409, detail="User already exists!")
+            await session.refresh(db_user)
+            return pg_user_to_dict(db_user)
+
+    async def activate_session(self, username, session_id):
+        row = await self._execute(activate_session_stmt(username, session_id), first=True)
+        return row is not None
+
+    async def update_password_hash(self, username, old_hash, new_hash):
+        await self._execute(update_password_hash_stmt(username, old_hash, new_hash))
+
+    async def set_status(self, username, status):
+        async with self.db.async_session_scope() as session:
+            await session.execute(
+                update(SQLUserDB)
+                .where(SQLUserDB.username == username)
+                .values(status=status))
+            await session.commit()
+
+    async def set_role(self, username, role, is_superuser):
+        row = await self._execute(set_role_stmt(username, role, is_superuser), first=True)
+        return row is not None
+
+    async def _execute(self, stmt, first=False):
+        async with self.db.async_session_scope() as session:
+            result = await session.execute(stmt)
+            row = result.mappings().first() if first else None
+            await session.commit()
+            return dict(row) if row else None
+
+    async def create_refresh_token(self, token, username, family_id, expiration_time,
+                                   prune_before=None, role=None):
+        async with self.db.async_session_scope() as session:
+            if prune_before is not None:
+                await session.execute(delete_refresh_tokens_stmt(username, prune_before))
+            await session.execute(
+                insert_refresh_token_stmt(token, username, family_id, expiration_time, role))
+            await session.commit()
+
+    async def use_refresh_token(self, token, now):
+        return await self._execute(use_refresh_token_stmt(token, now), first=True)
+
+    async def get_refresh_token(self, token):
+        return await self._execute(get_refresh_token_stmt(token), first=True)
+
+    async def delete_refresh_tokens(self, username, expired_before=None, family_id=None):
+        await self._execute(delete_refresh_tokens_stmt(username, expired_before, family_id))
+
+    async def expire_sessions(self, now, limit):
+        async with self.db.async_session_scope() as session:
+            tokens = (await session.execute(expired_refresh_tokens_stmt(now, limit))).all()
+            if not tokens:
+                return [], 0
+            sessions = list({(token.username, token.family_id) for token in tokens})
+            expired = list(await session.scalars(expire_sessions_stmt(sessions)))
+            await session.execute(
+                delete_refresh_tokens_by_id_stmt([token.id for token in tokens]))
+            await session.commit()
+            return expired, len(tokens)
+
+    async def expire_orphaned_sessions(self, now, limit):
+        async with self.db.async_session_scope() as session:
+            ids = list(await session.scalars(orphaned_sessions_stmt(now, limit)))
+            if not ids:
+                return []
+            expired = list(await session.scalars(expire_orphaned_sessions_stmt(ids, now)))
+            await session.commit()
+            return expired
+
+    async def trim_refresh_tokens(self, keep, limit):
+        async with self.db.async_session_scope() as session:
+            deleted = 0
+            for family_id in (await session.scalars(long_token_families_stmt(keep, limit))).all():
+                deleted += (await session.execute(trim_token_family_stmt(family_id, keep))).rowcount
+            await session.commit()
+            return deleted
+
+    list_fields = SQL_USER_LIST_FIELDS
+
+    async def list_users(self, fields, limit, after=None):
+        async with self.db.async_session_scope() as session:
+            result = await session.execute(list_users_stmt(fields, after, limit))
+            return [dict(row) for row in result.mappings()]
+
+    async def iter_users(self, fields, batch_size=1000):
+        async with self.db.async_session_scope() as session:
+            stmt = list_users_stmt(fields).execution_options(yield_per=batch_size)
+            result = await session.stream(stmt)
+            async for row in result.mappings():
+                yield dict(row)
+
+    def parse_cursor(self, after):
+        return _parse_sql_cursor(after)
+
+    async def bulk_create_users(self, users):
+        async with self.db.async_session_scope() as session:
+            duplicates = set(await session.scalars(
+                existing_usernames_stmt([user["username"] for user in users])))
+            rows = [user for user in users if user["username"] not in duplicates]
+            if not rows:
+                return duplicates
+            try:
+                await session.execute(insert(SQLUserDB), rows)
+                await session.commit()
+            except IntegrityError:
+                await session.rollback()
+                for row in rows:
+                    try:
+                        await session.execute(insert(SQLUserDB), [row])
+                        await session.commit()
+                    except IntegrityError:
+                        await session.rollback()
+                        duplicates.add(row["username"])
+            return duplicates
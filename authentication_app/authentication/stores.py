@@ -0,0 +1,130 @@
+# my_authentication_app/authentication/stores.py
+
+
+class UserStore:
+    """Backend neutral access to user records used by `Auth`.
+
+    Every method is awaitable and users are returned as plain dicts, so the
+    sync drivers (run in the threadpool) and the async drivers can be swapped
+    through `AuthConfig.async_mode` without touching the request path.
+    Implementations live in `sql_stores` and `mongo_stores`, and only the
+    selected one is imported.
+    """
+
+    async def get_user(self, username):
+        raise NotImplementedError
+
+    async def get_profile(self, username):
+        raise NotImplementedError
+
+    async def create_user(self, username, hashed_password, is_superuser, role="user"):
+        raise NotImplementedError
+
+    async def activate_session(self, username, session_id):
+        """Start `session_id` unless the user already has an active session.
+
+        A single conditional write, returns False when another session is active.
+        """
+        raise NotImplementedError
+
+    async def set_status(self, username, status):
+        raise NotImplementedError
+
+    async def set_role(self, username, role, is_superuser):
+        """Returns False when there is no such user."""
+        raise NotImplementedError
+
+    async def update_password_hash(self, username, old_hash, new_hash):
+        """Replace an outdated hash, unless the password changed meanwhile."""
+        raise NotImplementedError
+
+    # Refresh tokens, `token` is always the sha256 of the token handed out
+    async def create_refresh_token(self, token, username, family_id, expiration_time,
+                                   prune_before=None, role=None):
+        """Store a refresh token, dropping the user's tokens expired before `prune_before`.
+
+        `role` is the role the session was started with, renewals issue
+        access tokens with its scopes.
+        """
+        raise NotImplementedError
+
+    async def use_refresh_token(self, token, now):
+        """Atomically mark an unused, unexpired token as used and return it."""
+        raise NotImplementedError
+
+    async def get_refresh_token(self, token):
+        raise NotImplementedError
+
+    async def delete_refresh_tokens(self, username, expired_before=None, family_id=None):
+        raise NotImplementedError
+
+    # Sweeper, called in batches by `SessionSweeper`
+    async def expire_sessions(self, now, limit):
+        """End the sessions of up to `limit` refresh tokens expired before `now`.
+
+        Only a user still on the token's session is deactivated, and the
+        tokens are deleted. Returns the deactivated usernames and the number
+        of tokens deleted.
+        """
+        raise NotImplementedError
+
+    async def expire_orphaned_sessions(self, now, limit):
+        """End up to `limit` active sessions without an unexpired refresh token.
+
+        These are sessions started before refresh tokens were stored. Login
+        stores the token before activating, so a live login always has one,
+        and `SessionSweeper` only runs this on its first sweep. Returns the
+        deactivated usernames.
+        """
+        raise NotImplementedError
+
+    async def trim_refresh_tokens(self, keep, limit):
+        """Delete used tokens past the newest `keep` of up to `limit` sessions.
+
+        Returns the number of tokens deleted.
+        """
+        raise NotImplementedError
+
+    async def trim_session_history(self, keep, limit):
+        """Cut up to `limit` users' session history to the last `keep` logins.
+
+        Returns the number of users trimmed.
+        """
+        return 0
+
+    # Listing, `fields` is a subset of `list_fields` and always contains "id"
+    # and the `cursor_field` pages are ordered by
+    list_fields = ()
+    cursor_field = "id"
+
+    async def list_users(self, fields, limit, after=None):
+        """One keyset page of users with `cursor_field` greater than the `after` cursor."""
+        raise NotImplementedError
+
+    def iter_users(self, fields, batch_size=1000):
+        """Async iterator over every user, read through a server-side cursor."""
+        raise NotImplementedError
+
+    def parse_cursor(self, after: str):
+        raise NotImplementedError
+
+    async def bulk_create_users(self, users):
+        """Insert a batch of users, skipping usernames that already exist.
+
+        `users` are dicts with username, hashed_password, is_superuser and role.
+        Returns the set of usernames that were not inserted as duplicates.
+        """
+        raise NotImplementedError
+
+
+def get_user_store(db) -> UserStore:
+    if db.config.use_database == "postgresql":
+        from .sql_stores import AsyncSQLUserStore, SQLUserStore
+
+        return AsyncSQLUserStore(db) if db.config.async_mode else SQLUserStore(db)
+    elif db.config.use_database == "mongodb":
+        from .mongo_stores import MongoUserStore, MotorUserStore
+
+        return MotorUserStore(db) if db.config.async_mode else MongoUserStore(db)
+    else:
+        raise ValueError("Invalid database type. Please choose 'postgresql' or 'mongodb'.")
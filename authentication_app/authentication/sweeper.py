@@ -0,0 +1,131 @@
+# my_authentication_app/authentication/sweeper.py
+import asyncio
+import logging
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+class SessionSweeper:
+    """Background task that ends expired sessions and bounds session history.
+
+    A session expires with its refresh tokens, which all carry the session's
+    `expiration_time`. Every `interval` seconds the expired tokens are read
+    in batches of `batch_size` through the `expiration_time` index. Each
+    batch deactivates the users still on those sessions and deletes the
+    tokens, and the users' cached sessions are revoked on every worker.
+    Rotated tokens beyond the newest `history_limit` of a session are deleted
+    too.
+
+    The first sweep also repairs what older versions left behind: it ends
+    active sessions without any unexpired token, which only sessions from
+    before refresh tokens were stored can be, and trims MongoDB `sessions`
+    arrays written before they were capped.
+
+    Sweeps are idempotent, so each worker can run its own.
+    """
+
+    def __init__(self, auth, interval: float = 60, batch_size: int = 500,
+                 history_limit: int = 20, enabled: bool = True):
+        self.auth = auth
+        self.interval = interval
+        self.batch_size = batch_size
+        self.history_limit = history_limit
+        self.enabled = enabled
+        self._task = None
+        self.runs = 0
+        self.failures = 0
+        self.last = None
+        self.totals = {"expired_sessions": 0, "deleted_tokens": 0,
+                       "trimmed_tokens": 0, "trimmed_histories": 0, "seconds": 0.0}
+
+    @classmethod
+    def from_config(cls, auth):
+        config = auth.db.config
+        return cls(auth, interval=config.session_sweep_interval,
+                   batch_size=config.session_sweep_batch_size,
+                   history_limit=config.session_history_limit,
+                   enabled=config.session_sweep_enabled)
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception:
+                self.failures += 1
+                logger.exception("Session sweep failed")
+            await asyncio.sleep(self.interval)
+
+    async def _drain(self, step):
+        # repeat a batched step until a batch comes back short
+        total = 0
+        while True:
+            count = await step()
+            total += count
+            if count < self.batch_size:
+                return total
+
+    async def _revoke(self, usernames):
+        for username in usernames:
+            self.auth.session_cache.revoke_user(username)
+            await self.auth.sessions.publish_revocation(username)
+
+    async def sweep(self):
+        started = time.perf_counter()
+        store = self.auth.store
+        now = datetime.utcnow()
+        expired_sessions = 0
+
+        async def expire():
+            nonlocal expired_sessions
+            usernames, deleted = await store.expire_sessions(now, self.batch_size)
+            await self._revoke(usernames)
+            expired_sessions += len(usernames)
+            return deleted
+
+        async def expire_orphaned():
+            nonlocal expired_sessions
+            usernames = await store.expire_orphaned_sessions(now, self.batch_size)
+            await self._revoke(usernames)
+            expired_sessions += len(usernames)
+            return len(usernames)
+
+        deleted_tokens = await self._drain(expire)
+        trimmed_tokens = await self._drain(
+            lambda: store.trim_refresh_tokens(self.history_limit, self.batch_size))
+        trimmed_histories = 0
+        if self.runs == 0:
+            await self._drain(expire_orphaned)
+            trimmed_histories = await self._drain(
+                lambda: store.trim_session_history(self.history_limit, self.batch_size))
+        report = {"expired_sessions": expired_sessions, "deleted_tokens": deleted_tokens,
+                  "trimmed_tokens": trimmed_tokens, "trimmed_histories": trimmed_histories,
+                  "seconds": round(time.perf_counter() - started, 6)}
+
+        self.runs += 1
+        self.last = report
+        for name, value in report.items():
+            self.totals[name] += value
+        if any(report[name] for name in ("expired_sessions", "deleted_tokens",
+                                         "trimmed_tokens", "trimmed_histories")):
+            logger.info("Swept sessions in %.3fs: %s", report["seconds"], report)
+        return report
+
+    def stats(self):
+        return {"enabled": self.enabled, "interval": self.interval, "runs": self.runs,
+                "failures": self.failures, "last": self.last,
+                "totals": {name: round(value, 6) for name, value in self.totals.items()}}
@@ -0,0 +1,277 @@
+# my_authentication_app/authentication/tenants.py
+import asyncio
+import json
+import logging
+import secrets
+import time
+from collections import OrderedDict
+
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+
+from .auth import Auth
+from .config import AuthConfig
+from .database import Database
+from .hashing import PasswordHasher
+from .metrics import Metrics
+from .rate_limit import InMemoryRateLimitBackend, LoginRateLimiter
+from .schema import SchemaManager
+from .session_store import get_session_store
+
+logger = logging.getLogger(__name__)
+
+# overriding any of these gives the tenant its own hashing pool
+HASHER_FIELDS = {
+    "password_schemes", "bcrypt_rounds", "argon2_time_cost", "argon2_memory_cost",
+    "argon2_parallelism", "pbkdf2_rounds", "hash_executor", "hash_workers",
+    "hash_max_in_flight", "hash_max_queue", "bulk_hash_workers",
+}
+
+
+class Tenant:
+    """The `Database`, `Auth` and schema of one tenant."""
+
+    def __init__(self, name, auth: Auth, schema: SchemaManager, owns_hasher: bool = False,
+                 owns_sessions: bool = True):
+        self.name = name
+        self.auth = auth
+        self.db = auth.db
+        self.schema = schema
+        self.owns_hasher = owns_hasher
+        self.owns_sessions = owns_sessions
+        self.in_flight = 0
+        self.last_used = time.monotonic()
+
+    async def start(self, check_schema: bool = True):
+        # connecting, the schema check and subscribing block, keep them off the loop
+        await run_in_threadpool(self.db.connect)
+        if check_schema:
+            await run_in_threadpool(self.schema.run, self.db.config.schema_mode)
+        if self.owns_sessions:
+            await run_in_threadpool(self.auth.sessions.start)
+        self.auth.sweeper.start()
+
+    async def stop(self):
+        await self.auth.sweeper.stop()
+        await self.auth.wait_background_tasks()
+        if self.owns_sessions:
+            # the Redis store joins its listener thread
+            await run_in_threadpool(self.auth.sessions.stop)
+        else:
+            self.auth.sessions.unsubscribe(self.auth._on_session_event)
+        if self.owns_hasher:
+            self.auth.hasher.shutdown()
+        await self.db.dispose_async()
+
+
+class TenantRegistry:
+    """Per-tenant `Auth` bundles, built on first use and closed when idle.
+
+    A request's tenant is named by the `header` request header, or else found
+    by its Host: one listed under the tenant's "hosts", or the first label of
+    the host name (`acme.auth.example.com` -> `acme`). A tenant's config is
+    the base config with its overrides applied.
+
+    At most `max_active` tenants keep their pools open. Past that, or after
+    `idle_seconds` without a request, the least recently used tenants with no
+    request in flight are closed, and rebuilt when next needed. Password
+    hashing workers and metrics are shared by every tenant. In-memory login
+    counters and revocation sets are kept here too, so closing a tenant does
+    not reset its throttling or forget its logouts.
+    """
+
+    def __init__(self, config: AuthConfig, tenants: dict, max_active: int = 32,
+                 idle_seconds: float = 600, header: str = "X-Tenant"):
+        self.config = config
+        self.tenants = tenants
+        self.hosts = {host.lower(): name for name, overrides in tenants.items()
+                      for host in overrides.get("hosts", ())}
+        # ASGI header names are lowercase bytes
+        self.header = header.lower().encode("latin-1") if header else None
+        self.max_active = max_active
+        self.idle_seconds = idle_seconds
+        self.sweep_interval = min(idle_seconds, 60)
+        self.metrics = Metrics(enabled=config.metrics_enabled)
+        self.hasher = PasswordHasher.from_config(config)
+        # one backend for every tenant's counters, keys are prefixed by tenant
+        self.rate_limit_backend = InMemoryRateLimitBackend()
+        self._session_stores = {}
+        self._active = OrderedDict()
+        self._configs = {}
+        self._locks = {}
+        self._schema_checked = set()
+        self._stopping = set()
+        self._dummy_hash = None
+        self._next_sweep = 0
+        self.created = 0
+        self.evicted = 0
+
+    @classmethod
+    def from_config(cls, config: AuthConfig):
+        with open(config.tenants_file) as fh:
+            tenants = json.load(fh)
+        return cls(config, tenants, max_active=config.tenant_max_active,
+                   idle_seconds=config.tenant_idle_seconds, header=config.tenant_header)
+
+    def resolve(self, scope):
+        """Name of the tenant an ASGI request is for, None if there is none."""
+        name, host = None, ""
+        for key, value in scope["headers"]:
+            if key == self.header:
+                name = value.decode("latin-1").strip()
+            elif key == b"host":
+                host = value.decode("latin-1").lower()
+        if name is None:
+            if host.rfind(":") > host.rfind("]"):
+                host = host[:host.rfind(":")]
+            name = self.hosts.get(host) or host.split(".", 1)[0]
+        return name if name in self.tenants else None
+
+    def tenant_config(self, name) -> AuthConfig:
+        # built once, reading the settings sources costs more than the rest of a rebuild
+        config = self._configs.get(name)
+        if config is None:
+            config = self._configs[name] = self._make_config(name)
+        return config
+
+    def _make_config(self, name) -> AuthConfig:
+        overrides = {key: value for key, value in self.tenants[name].items() if key != "hosts"}
+        # keep the tenants' session events and login counters apart on a shared Redis
+        defaults = {"session_channel": f"{self.config.session_channel}:{name}",
+                    "session_key_prefix": f"{self.config.session_key_prefix}{name}:",
+                    "login_rate_limit_prefix": f"{self.config.login_rate_limit_prefix}{name}:",
+                    "tenants_file": ""}
+        return AuthConfig(**{**self.config.model_dump(), **defaults, **overrides})
+
+    def _build(self, name) -> Tenant:
+        config = self.tenant_config(name)
+        db = Database(config, metrics=self.metrics)
+        # Redis keeps the tenant's state itself, under the tenant's key prefix
+        rate_limiter = sessions = None
+        if config.login_rate_limit_backend == "memory":
+            rate_limiter = LoginRateLimiter.from_config(
+                config, backend=self.rate_limit_backend, key_prefix=f"{name}:")
+        if config.session_store == "memory":
+            sessions = self._session_stores.get(name)
+            if sessions is None:
+                sessions = self._session_stores[name] = get_session_store(config)
+        owns_hasher = bool(HASHER_FIELDS & self.tenants[name].keys())
+        auth = Auth(db, hasher=None if owns_hasher else self.hasher,
+                    sessions=sessions, rate_limiter=rate_limiter,
+                    dummy_hash=None if owns_hasher else self._dummy_hash)
+        return Tenant(name, auth, SchemaManager(db), owns_hasher=owns_hasher,
+                      owns_sessions=sessions is None)
+
+    async def start(self):
+        # one dummy hash for every tenant on the shared hasher
+        self._dummy_hash = await self.hasher.hash(secrets.token_urlsafe(16))
+
+    async def acquire(self, name) -> Tenant:
+        tenant = self._active.get(name)
+        if tenant is None:
+            tenant = await self._create(name)
+        self._active.move_to_end(name)
+        tenant.in_flight += 1
+        now = time.monotonic()
+        if len(self._active) > self.max_active or now >= self._next_sweep:
+            self._evict(now)
+        return tenant
+
+    def release(self, tenant: Tenant):
+        tenant.in_flight -= 1
+        tenant.last_used = time.monotonic()
+        # tenants kept past the limit while busy are closed once done
+        if len(self._active) > self.max_active:
+            self._evict(tenant.last_used)
+
+    async def _create(self, name) -> Tenant:
+        lock = self._locks.setdefault(name, asyncio.Lock())
+        async with lock:
+            tenant = self._active.get(name)
+            if tenant is not None:
+                return tenant
+            started = time.perf_counter()
+            # loading the tenant's JWT keys reads (or writes) key files
+            tenant = await run_in_threadpool(self._build, name)
+            try:
+                # the schema only needs checking once per process
+                await tenant.start(check_schema=name not in self._schema_checked)
+            except Exception:
+                await tenant.stop()
+                raise
+            self._schema_checked.add(name)
+            self._active[name] = tenant
+            self.created += 1
+            logger.info("Started tenant %s in %.3fs", name, time.perf_counter() - started)
+            return tenant
+
+    def _evict(self, now):
+        # least recently used first, tenants serving a request are kept
+        self._next_sweep = now + self.sweep_interval
+        excess = len(self._active) - self.max_active
+        for name, tenant in list(self._active.items()):
+            if tenant.in_flight:
+                continue
+            if excess > 0 or now - tenant.last_used > self.idle_seconds:
+                del self._active[name]
+                excess -= 1
+                self.evicted += 1
+                task = asyncio.create_task(self._stop(tenant))
+                self._stopping.add(task)
+                task.add_done_callback(self._stopping.discard)
+
+    async def _stop(self, tenant: Tenant):
+        try:
+            await tenant.stop()
+        except Exception:
+            logger.exception("Could not close tenant %s", tenant.name)
+        else:
+            logger.info("Closed idle tenant %s", tenant.name)
+
+    async def close(self):
+        tenants = list(self._active.values())
+        self._active.clear()
+        await asyncio.gather(*(self._stop(tenant) for tenant in tenants), *self._stopping)
+        for sessions in self._session_stores.values():
+            sessions.stop()
+        self.hasher.shutdown()
+
+    def stats(self):
+        return {"configured": len(self.tenants),
+                "active": len(self._active),
+                "max_active": self.max_active,
+                "in_flight": sum(tenant.in_flight for tenant in self._active.values()),
+                "created": self.created,
+                "evicted": self.evicted}
+
+
+class TenantMiddleware:
+    """Resolves each request's tenant and keeps it open until the response is sent.
+
+    The tenant's `Auth` is put in the request state, where `get_auth` finds it.
+    """
+
+    def __init__(self, app, tenants: TenantRegistry):
+        self.app = app
+        self.tenants = tenants
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        name = self.tenants.resolve(scope)
+        if name is None:
+            response = JSONResponse({"detail": "Unknown tenant"}, status_code=404)
+            return await response(scope, receive, send)
+        try:
+            tenant = await self.tenants.acquire(name)
+        except Exception:
+            logger.exception("Could not start tenant %s", name)
+            response = JSONResponse({"detail": "Tenant unavailable"}, status_code=503)
+            return await response(scope, receive, send)
+        state = scope.setdefault("state", {})
+        state["tenant"] = tenant
+        state["auth"] = tenant.auth
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.tenants.release(tenant)
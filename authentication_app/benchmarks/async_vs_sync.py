@@ -0,0 +1,123 @@
+# my_authentication_app/benchmarks/async_vs_sync.py
+"""Load benchmark of `/login` and `/me` with the sync and async storage layers.
+
+Starts one uvicorn worker per mode against the configured database, signs up
+a batch of throwaway users and drives the endpoints concurrently with httpx.
+
+    cd authentication_app
+    python -m benchmarks.async_vs_sync --users 200 --concurrency 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+
+import httpx
+
+from .common import summarize, timed
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def run_mode(base_url, users, concurrency, me_requests):
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        prefix = f"bench-{uuid.uuid4().hex[:8]}"
+        names = [f"{prefix}-{i}" for i in range(users)]
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def signup(name):
+            async with semaphore:
+                await client.post("/signup", params={"username": name, "password": "bench"})
+
+        await asyncio.gather(*(signup(name) for name in names))
+
+        # /login: every user logs in once, timed; logout is not part of the sample
+        login_latencies, tokens = [], {}
+
+        async def login(name):
+            async with semaphore:
+                response = await timed(lambda: client.post(
+                    "/login", data={"username": name, "password": "bench"}), login_latencies)
+                if response.status_code == 200:
+                    tokens[name] = response.json()["access_token"]
+
+        started = time.perf_counter()
+        await asyncio.gather(*(login(name) for name in names))
+        login_stats = summarize(login_latencies, time.perf_counter() - started)
+
+        # /me: round-robin over the logged in users
+        me_latencies = []
+        headers = [{"Authorization": f"Bearer {token}"} for token in tokens.values()]
+
+        async def me(i):
+            async with semaphore:
+                await timed(lambda: client.get("/me", headers=headers[i % len(headers)]),
+                            me_latencies)
+
+        started = time.perf_counter()
+        if headers:
+            await asyncio.gather(*(me(i) for i in range(me_requests)))
+        me_stats = summarize(me_latencies, time.perf_counter() - started)
+
+        for name, token in tokens.items():
+            await client.post(f"/logout/{name}", headers={"Authorization": f"Bearer {token}"})
+        return {"/login": login_stats, "/me": me_stats}
+
+
+def start_server(async_mode, port):
+    env = dict(os.environ, ASYNC_MODE=str(async_mode).lower(),
+               LOGIN_RATE_LIMIT_ENABLED="false")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=APP_DIR, env=env)
+
+
+def wait_for(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(base_url + "/").status_code == 200:
+                return
+        except httpx.TransportError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server at {base_url} did not come up")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--me-requests", type=int, default=2000)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for mode, async_mode in (("sync", False), ("async", True)):
+        server = start_server(async_mode, args.port)
+        base_url = f"http://127.0.0.1:{args.port}"
+        try:
+            wait_for(base_url)
+            results[mode] = asyncio.run(
+                run_mode(base_url, args.users, args.concurrency, args.me_requests))
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(f"{'mode':<6} {'endpoint':<8} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for mode, endpoints in results.items():
+        for endpoint, stats in endpoints.items():
+            print(f"{mode:<6} {endpoint:<8} {stats['req_per_s']:>9} "
+                  f"{stats['p50_ms']:>9} {stats['p99_ms']:>9}")
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
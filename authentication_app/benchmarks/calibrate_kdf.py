@@ -0,0 +1,96 @@
+# my_authentication_app/benchmarks/calibrate_kdf.py
+"""Pick password hashing costs that hit a target verify latency on this machine.
+
+Measures the scheme's verify time at a cheap cost, extrapolates, then searches
+for the largest cost that stays within the target. Prints the settings to put
+in the environment (or `AuthConfig`).
+
+    cd authentication_app
+    python -m benchmarks.calibrate_kdf --target-ms 250
+    python -m benchmarks.calibrate_kdf --scheme argon2 --target-ms 100 --argon2-memory-cost 19456
+"""
+import argparse
+import math
+import statistics
+import time
+
+from authentication.config import AuthConfig
+from authentication.hashing import build_crypt_context
+
+# config field tuned for each scheme, its lowest value and how the cost grows
+COST_PARAMETERS = {
+    "bcrypt": ("bcrypt_rounds", 4, 31, "exponential"),
+    "argon2": ("argon2_time_cost", 1, 1000, "linear"),
+    "pbkdf2_sha256": ("pbkdf2_rounds", 1000, 100_000_000, "linear"),
+}
+
+
+def measure(config, samples):
+    context = build_crypt_context(config)
+    hashed = context.hash("calibration-password")
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        context.verify("calibration-password", hashed)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def calibrate(scheme, target, samples, overrides):
+    field, lowest, highest, growth = COST_PARAMETERS[scheme]
+
+    def latency(cost):
+        config = AuthConfig(password_schemes=scheme, **{**overrides, field: cost})
+        seconds = measure(config, samples)
+        print(f"  {field}={cost:<10} {seconds * 1000:>9.1f} ms")
+        return seconds
+
+    base = latency(lowest)
+    if growth == "exponential":
+        # every extra round doubles the work
+        estimate = lowest + int(math.log2(max(target / base, 1)))
+        low, high = max(lowest, estimate - 2), min(highest, estimate + 2)
+        resolution = 1
+    else:
+        estimate = int(lowest * target / base)
+        low, high = max(lowest, estimate // 2), min(highest, max(estimate * 2, lowest))
+        # timings are noisy, closer than ~2% is not worth measuring
+        resolution = max(1, estimate // 50)
+
+    # largest cost whose latency stays within the target
+    best = lowest
+    while low <= high:
+        cost = (low + high) // 2
+        if latency(cost) <= target:
+            best, low = cost, cost + resolution
+        else:
+            high = cost - resolution
+    return field, best
+
+
+def main(argv=None):
+    config = AuthConfig()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scheme", choices=sorted(COST_PARAMETERS),
+                        default=config.password_schemes.split(",")[0].strip())
+    parser.add_argument("--target-ms", type=float, default=250)
+    parser.add_argument("--samples", type=int, default=3, help="verifies per measurement")
+    parser.add_argument("--argon2-memory-cost", type=int, default=config.argon2_memory_cost)
+    parser.add_argument("--argon2-parallelism", type=int, default=config.argon2_parallelism)
+    args = parser.parse_args(argv)
+
+    overrides = {}
+    if args.scheme == "argon2":
+        overrides = {"argon2_memory_cost": args.argon2_memory_cost,
+                     "argon2_parallelism": args.argon2_parallelism}
+    print(f"calibrating {args.scheme} for {args.target_ms} ms per verify")
+    field, cost = calibrate(args.scheme, args.target_ms / 1000, args.samples, overrides)
+
+    print()
+    print(f"PASSWORD_SCHEMES={args.scheme}")
+    for name, value in {**overrides, field: cost}.items():
+        print(f"{name.upper()}={value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+# my_authentication_app/benchmarks/common.py
+import statistics
+import time
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(latencies, elapsed):
+    return {
+        "requests": len(latencies),
+        "req_per_s": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2) if latencies else 0.0,
+    }
+
+
+async def timed(call, latencies):
+    started = time.perf_counter()
+    response = await call()
+    latencies.append(time.perf_counter() - started)
+    return response
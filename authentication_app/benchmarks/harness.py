@@ -0,0 +1,237 @@
+# my_authentication_app/benchmarks/harness.py
+"""Benchmark harness for the auth endpoints.
+
+Drives /signup, /login, /protected, /me, /renew-token and /logout and
+reports req/s, p50/p95/p99 latency and DB calls per request for each one.
+By default the app runs in-process (ASGI transport) on a local stand-in for
+the database; `--url` targets a running uvicorn instead, where DB calls are
+taken from the pool checkout counter on /metrics.
+
+    cd authentication_app
+    python -m benchmarks.harness run --backend sqlite --output before.json
+    python -m benchmarks.harness run --backend mongomock --output after.json
+    python -m benchmarks.harness compare before.json after.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime
+
+import httpx
+
+from .common import summarize
+
+ENDPOINTS = ("/signup", "/login", "/protected", "/me", "/renew-token", "/logout")
+
+
+class Target:
+    """An HTTP client plus a way to read the DB call counter."""
+
+    def __init__(self, client, count_calls):
+        self.client = client
+        self.count_calls = count_calls
+
+
+async def run_phase(target, requests, concurrency):
+    # `requests` are zero-argument callables returning a response coroutine
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, responses, errors = [], [], 0
+
+    async def run(request):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            response = await request()
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+            return response
+
+    calls_before = await target.count_calls()
+    started = time.perf_counter()
+    responses = await asyncio.gather(*(run(request) for request in requests))
+    elapsed = time.perf_counter() - started
+    calls = await target.count_calls() - calls_before
+    stats = summarize(latencies, elapsed)
+    stats["errors"] = errors
+    stats["db_calls_per_request"] = round(calls / len(requests), 2) if requests else 0.0
+    return stats, responses
+
+
+async def run_scenario(target, users, requests, concurrency):
+    client = target.client
+    names = [f"bench-{uuid.uuid4().hex[:8]}-{i}" for i in range(users)]
+    results = {}
+
+    def form(name):
+        return {"username": name, "password": "bench-password"}
+
+    results["/signup"], _ = await run_phase(target, [
+        lambda name=name: client.post("/signup", params=form(name)) for name in names
+    ], concurrency)
+
+    results["/login"], responses = await run_phase(target, [
+        lambda name=name: client.post("/login", data=form(name)) for name in names
+    ], concurrency)
+    sessions = [response.json() for response in responses if response.status_code == 200]
+    if not sessions:
+        raise RuntimeError("no user could log in, check the server logs")
+
+    def bearer(i):
+        return {"Authorization": f"Bearer {sessions[i % len(sessions)]['access_token']}"}
+
+    for endpoint in ("/protected", "/me"):
+        results[endpoint], _ = await run_phase(target, [
+            lambda i=i, endpoint=endpoint: client.get(endpoint, headers=bearer(i))
+            for i in range(requests)
+        ], concurrency)
+
+    results["/renew-token"], responses = await run_phase(target, [
+        lambda session=session: client.post(
+            "/renew-token", json={"refresh_token": session["refresh_token"]})
+        for session in sessions
+    ], concurrency)
+    renewed = [response.json() for response in responses if response.status_code == 200]
+
+    results["/logout"], _ = await run_phase(target, [
+        lambda name=name, session=session: client.post(
+            f"/logout/{name}", headers={"Authorization": f"Bearer {session['access_token']}"})
+        for name, session in zip(names, renewed)
+    ], concurrency)
+    return results
+
+
+async def run_in_process(args):
+    from authentication.config import AuthConfig
+    from main import create_app
+    from .standins import create_standin
+
+    # every simulated user logs in from the same address
+    config = AuthConfig(async_mode=args.async_mode, login_rate_limit_enabled=False)
+    standin = create_standin(args.backend, config)
+    app = create_app(db=standin)
+
+    async def count_calls():
+        return standin.calls.value
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            return await run_scenario(Target(client, count_calls),
+                                      args.users, args.requests, args.concurrency)
+
+
+async def run_remote(args):
+    async with httpx.AsyncClient(base_url=args.url, timeout=60) as client:
+        async def count_calls():
+            response = await client.get("/metrics")
+            for line in response.text.splitlines():
+                if line.startswith("auth_db_pool_checkouts_total "):
+                    return float(line.split()[1])
+            raise RuntimeError("/metrics has no auth_db_pool_checkouts_total")
+
+        return await run_scenario(Target(client, count_calls),
+                                  args.users, args.requests, args.concurrency)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(results):
+    print(f"{'endpoint':<13} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'db/req':>7} {'errors':>7}")
+    for endpoint in ENDPOINTS:
+        stats = results.get(endpoint)
+        if stats:
+            print(f"{endpoint:<13} {stats['req_per_s']:>9} {stats['p50_ms']:>9} "
+                  f"{stats['p95_ms']:>9} {stats['p99_ms']:>9} "
+                  f"{stats['db_calls_per_request']:>7} {stats['errors']:>7}")
+
+
+def run(args):
+    if args.url:
+        results = asyncio.run(run_remote(args))
+    else:
+        results = asyncio.run(run_in_process(args))
+    print_table(results)
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "target": args.url or f"in-process:{args.backend}",
+            "async_mode": args.async_mode,
+            "users": args.users,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "python": platform.python_version(),
+            "timestamp": datetime.utcnow().isoformat(),
+        },
+        "endpoints": results,
+    }
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(report, fh, indent=2)
+    return 0
+
+
+def compare(args):
+    with open(args.baseline) as fh:
+        baseline = json.load(fh)
+    with open(args.candidate) as fh:
+        candidate = json.load(fh)
+    print(f"{baseline['meta'].get('commit')} -> {candidate['meta'].get('commit')}")
+    print(f"{'endpoint':<13} {'req/s':>16} {'p99 ms':>18} {'db/req':>12}")
+    regressed = False
+    for endpoint in ENDPOINTS:
+        old, new = baseline["endpoints"].get(endpoint), candidate["endpoints"].get(endpoint)
+        if not old or not new:
+            continue
+        throughput = (new["req_per_s"] - old["req_per_s"]) / old["req_per_s"] if old["req_per_s"] else 0.0
+        latency = (new["p99_ms"] - old["p99_ms"]) / old["p99_ms"] if old["p99_ms"] else 0.0
+        worse = (throughput < -args.threshold or latency > args.threshold
+                 or new["db_calls_per_request"] > old["db_calls_per_request"])
+        regressed = regressed or worse
+        print(f"{endpoint:<13} {old['req_per_s']:>7}->{new['req_per_s']:<8} "
+              f"{old['p99_ms']:>8}->{new['p99_ms']:<9} "
+              f"{old['db_calls_per_request']:>5}->{new['db_calls_per_request']:<5}"
+              f"{'  REGRESSION' if worse else ''}")
+    return 1 if regressed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the auth endpoints.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmark")
+    run_parser.add_argument("--backend", choices=("sqlite", "mongomock"), default="sqlite",
+                            help="in-process stand-in for the database")
+    run_parser.add_argument("--url", help="benchmark a running server instead")
+    run_parser.add_argument("--async-mode", action="store_true",
+                            help="use the async storage layer (sqlite only)")
+    run_parser.add_argument("--users", type=int, default=50)
+    run_parser.add_argument("--requests", type=int, default=1000,
+                            help="requests for each of /protected and /me")
+    run_parser.add_argument("--concurrency", type=int, default=20)
+    run_parser.add_argument("--output", help="write machine-readable results to this file")
+
+    compare_parser = commands.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.add_argument("--threshold", type=float, default=0.1,
+                                help="relative req/s or p99 change counted as a regression")
+
+    args = parser.parse_args(argv)
+    return run(args) if args.command == "run" else compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+# my_authentication_app/benchmarks/serialization.py
+"""Serialization cost per user record for `/me` and `/all`, before and after.
+
+Before, `/me` returned the whole row (password hash and session id included,
+and on MongoDB the session history) and both routes went through FastAPI's
+`jsonable_encoder` and `JSONResponse`. Now the stores select the profile
+columns only, and the rows are validated against the route's response model
+and rendered by `ORJSONResponse`. Both sides run through FastAPI's own
+`serialize_response`, as a request would.
+
+    cd authentication_app
+    python -m benchmarks.serialization
+    python -m benchmarks.serialization --page-size 1000 --sessions 50
+"""
+import argparse
+import asyncio
+import json
+import secrets
+import statistics
+import time
+import uuid
+from datetime import datetime
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from authentication.responses import PROFILE_FIELDS, UserPage, UserProfile
+
+
+def sql_row(i):
+    return {"id": i, "username": f"user-{i}", "hashed_password": "$2b$12$" + secrets.token_hex(26),
+            "session_id": uuid.uuid4().hex, "status": "active",
+            "created_at": datetime.utcnow(), "is_superuser": False}
+
+
+def mongo_doc(i, sessions):
+    # `_id` and the hash were already left out of the old `/me` projection
+    return {"username": f"user-{i}", "is_superuser": False,
+            "sessions": [{uuid.uuid4().hex: {}} for _ in range(sessions)],
+            "session_id": uuid.uuid4().hex, "status": "active",
+            "created_at": datetime.utcnow(), "role": "user"}
+
+
+def profile(row):
+    return {name: row[name] for name in PROFILE_FIELDS if name in row}
+
+
+def list_row(row):
+    return {name: row[name] for name in ("id", "username", "is_superuser", "status", "created_at")}
+
+
+def cases(page_size, sessions):
+    me = create_response_field(name="me", type_=UserProfile, mode="serialization")
+    page = create_response_field(name="page", type_=UserPage, mode="serialization")
+    rows = [sql_row(i) for i in range(page_size)]
+    users = [list_row(row) for row in rows]
+    return {
+        "/me postgresql": (1, (None, sql_row(0), JSONResponse, {}),
+                           (me, profile(sql_row(0)), ORJSONResponse, {})),
+        "/me mongodb": (1, (None, mongo_doc(0, sessions), JSONResponse, {}),
+                        (me, profile(mongo_doc(0, sessions)), ORJSONResponse, {})),
+        f"/all page of {page_size}": (
+            page_size, (None, {"users": users, "next": None}, JSONResponse, {}),
+            (page, {"users": users, "next": None}, ORJSONResponse, {"exclude_unset": True})),
+    }
+
+
+async def render(field, content, response_class, options):
+    return response_class(await serialize_response(
+        field=field, response_content=content, **options)).body
+
+
+async def measure(field, content, response_class, options, iterations, repeat):
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            await render(field, content, response_class, options)
+        runs.append((time.perf_counter() - started) / iterations)
+    return statistics.median(runs)
+
+
+async def run(args):
+    results = {}
+    for name, (records, before, after) in cases(args.page_size, args.sessions).items():
+        iterations = max(1, args.records // records)
+        result = {}
+        for label, case in (("before", before), ("after", after)):
+            body = await render(*case)
+            seconds = await measure(*case, iterations, args.repeat)
+            result[label] = {"us_per_record": round(seconds / records * 1e6, 2),
+                             "bytes_per_record": len(body) // records}
+        results[name] = result
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--sessions", type=int, default=20,
+                        help="logins in the MongoDB session history")
+    parser.add_argument("--records", type=int, default=20000, help="records per measurement")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(run(args))
+    print(f"{'case':<20} {'before us':>10} {'after us':>9} {'speedup':>8} {'before B':>9} {'after B':>8}")
+    for name, result in results.items():
+        before, after = result["before"], result["after"]
+        speedup = before["us_per_record"] / after["us_per_record"]
+        print(f"{name:<20} {before['us_per_record']:>10} {after['us_per_record']:>9} "
+              f"{speedup:>7.1f}x {before['bytes_per_record']:>9} {after['bytes_per_record']:>8}")
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
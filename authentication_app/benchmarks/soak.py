@@ -0,0 +1,202 @@
+# my_authentication_app/benchmarks/soak.py
+"""Soak test for session state under concurrent login / renew / logout.
+
+Every simulated user runs `--rounds` cycles against the in-process app on a
+local stand-in, all users at once: login, /me, a request with an expired
+access token, renew, /me, logout, then the logged out tokens again. Every
+response is checked, so one request's expiry or revocation handling leaking
+into another's shows up as a wrong status or a profile of the wrong user.
+Odd rounds log out with an expired access token, which must still work.
+
+After every round the pool, caches, background tasks, threads and the Python
+heap are sampled. The run fails on any unexpected response, a connection
+still checked out, a session left active, or heap growth past
+`--max-growth-kb` between the end of the warm-up and the last round.
+
+    cd authentication_app
+    python -m benchmarks.soak --backend sqlite
+    python -m benchmarks.soak --backend mongomock --users 500 --rounds 10
+    python -m benchmarks.soak --backend sqlite --async-mode --concurrency 10
+
+SQLite takes one writer at a time, with the async driver keep the
+concurrency low or writes fail with "database is locked".
+"""
+import argparse
+import asyncio
+import gc
+import json
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from datetime import timedelta
+
+import httpx
+import jwt
+
+
+class Soak:
+    def __init__(self, app, client, names):
+        self.app = app
+        self.auth = app.state.auth
+        self.client = client
+        self.names = names
+        self.failures = Counter()
+        self.requests = 0
+
+    def expect(self, step, response, status, username=None):
+        self.requests += 1
+        if response.status_code != status:
+            self.failures[f"{step}: {response.status_code} instead of {status}"] += 1
+            return False
+        if username is not None and response.json()["username"] != username:
+            self.failures[f"{step}: profile of another user"] += 1
+            return False
+        return True
+
+    def expired_token(self, access_token):
+        # same session and scopes, already expired
+        claims = jwt.decode(access_token, options={"verify_signature": False})
+        data = {key: claims[key] for key in ("sub", "sid", "scope")}
+        return self.auth.encode_access_token(data, expires_delta=timedelta(seconds=-1))
+
+    async def cycle(self, name, expired_logout):
+        client = self.client
+
+        def bearer(token):
+            return {"Authorization": f"Bearer {token}"}
+
+        response = await client.post("/login", data={"username": name, "password": "soak"})
+        if not self.expect("login", response, 200):
+            return
+        tokens = response.json()
+        expired = self.expired_token(tokens["access_token"])
+
+        self.expect("/me", await client.get("/me", headers=bearer(tokens["access_token"])),
+                    200, name)
+        self.expect("expired token", await client.get("/protected", headers=bearer(expired)), 403)
+
+        response = await client.post("/renew-token", json={"refresh_token": tokens["refresh_token"]})
+        if not self.expect("renew", response, 200):
+            return
+        renewed = response.json()
+        self.expect("/me renewed", await client.get("/me", headers=bearer(renewed["access_token"])),
+                    200, name)
+
+        logout_token = expired if expired_logout else renewed["access_token"]
+        self.expect("logout", await client.post(f"/logout/{name}", headers=bearer(logout_token)), 200)
+
+        self.expect("/me after logout",
+                    await client.get("/me", headers=bearer(renewed["access_token"])), 401)
+        self.expect("renew after logout", await client.post(
+            "/renew-token", json={"refresh_token": renewed["refresh_token"]}), 401)
+
+    async def round(self, number, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(name):
+            async with semaphore:
+                await self.cycle(name, expired_logout=number % 2 == 1)
+
+        await asyncio.gather(*(run(name) for name in self.names))
+
+    def sample(self):
+        gc.collect()
+        auth = self.auth
+        return {"heap_kb": round(tracemalloc.get_traced_memory()[0] / 1024, 1),
+                "checked_out": auth.db.pool_stats().get("checked_out", 0),
+                "session_cache_size": auth.session_cache.stats()["size"],
+                "revoked_sessions": auth.sessions.revoked_count(),
+                "background_tasks": len(auth._background_tasks),
+                "threads": threading.active_count()}
+
+
+async def active_sessions(store, names):
+    # read back through get_user, whose row carries the session status
+    return [name for name in names
+            if ((await store.get_user(name)) or {}).get("status") == "active"]
+
+
+async def soak(args):
+    from authentication.config import AuthConfig
+    from main import create_app
+    from .standins import create_standin
+
+    # every login may wait for a hash at once, backpressure is not under test
+    config = AuthConfig(async_mode=args.async_mode, login_rate_limit_enabled=False,
+                        bcrypt_rounds=args.bcrypt_rounds, hash_max_queue=args.concurrency,
+                        session_history_limit=3)
+    standin = create_standin(args.backend, config)
+    app = create_app(db=standin)
+    names = [f"soak-{uuid.uuid4().hex[:8]}-{i}" for i in range(args.users)]
+
+    # an exception in the app counts as a failed response, not the end of the run
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://soak") as client:
+            run = Soak(app, client, names)
+            semaphore = asyncio.Semaphore(args.concurrency)
+
+            async def signup(name):
+                async with semaphore:
+                    run.expect("signup", await client.post(
+                        "/signup", params={"username": name, "password": "soak"}), 200)
+            await asyncio.gather(*(signup(name) for name in names))
+
+            tracemalloc.start()
+            rounds = []
+            for number in range(args.rounds):
+                started = time.perf_counter()
+                await run.round(number, args.concurrency)
+                elapsed = time.perf_counter() - started
+                rounds.append({"round": number, "cycles_per_s": round(len(names) / elapsed, 1),
+                               **run.sample()})
+                print(json.dumps(rounds[-1]), flush=True)
+            tracemalloc.stop()
+
+            still_active = await active_sessions(app.state.auth.store, names)
+
+    warm = rounds[min(args.warmup, len(rounds)) - 1]
+    growth = rounds[-1]["heap_kb"] - warm["heap_kb"]
+    problems = [f"{count}x {failure}" for failure, count in sorted(run.failures.items())]
+    leaked = max(sample["checked_out"] for sample in rounds)
+    if leaked:
+        problems.append(f"{leaked} connections still checked out after a round")
+    if still_active:
+        problems.append(f"{len(still_active)} sessions left active")
+    if rounds[-1]["background_tasks"]:
+        problems.append(f"{rounds[-1]['background_tasks']} background tasks left")
+    if growth > args.max_growth_kb:
+        problems.append(f"heap grew {growth:.0f} KiB after the warm-up rounds")
+    return {"cycles": len(names) * args.rounds, "requests": run.requests,
+            "heap_growth_kb": round(growth, 1), "rounds": rounds, "problems": problems}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend", choices=("sqlite", "mongomock"), default="sqlite")
+    parser.add_argument("--async-mode", action="store_true", help="use the async drivers")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=10, help="cycles per user")
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=3, help="rounds before heap growth is measured")
+    parser.add_argument("--max-growth-kb", type=float, default=512)
+    parser.add_argument("--bcrypt-rounds", type=int, default=4)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    result = asyncio.run(soak(args))
+    print(f"{result['cycles']} cycles, {result['requests']} requests, "
+          f"heap growth after warm-up {result['heap_growth_kb']} KiB")
+    for problem in result["problems"]:
+        print(f"FAIL {problem}")
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(result, fh, indent=2)
+    return 1 if result["problems"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
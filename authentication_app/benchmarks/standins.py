@@ -0,0 +1,114 @@
+# my_authentication_app/benchmarks/standins.py
+"""Local stand-ins for the real backends, with DB call counting.
+
+`SQLiteDatabase` runs the PostgreSQL code path against a SQLite file and
+`MongomockDatabase` runs the MongoDB code path against mongomock, so the
+harness needs neither server. Both count database round-trips in `calls`.
+"""
+import os
+import tempfile
+import threading
+
+from sqlalchemy import event
+
+from authentication.database import Database
+from authentication.postgresql_models import Base
+
+# Collection methods that cost one round-trip against a real server
+MONGO_CALLS = {
+    "find_one", "find", "insert_one", "insert_many", "update_one", "update_many",
+    "find_one_and_update", "delete_one", "delete_many", "count_documents",
+    "create_index", "aggregate", "bulk_write",
+}
+
+
+class CallCounter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def incr(self):
+        with self._lock:
+            self.value += 1
+
+
+class SQLiteDatabase(Database):
+    def __init__(self, config, path=None):
+        self.path = path or os.path.join(tempfile.mkdtemp(prefix="auth-bench-"), "auth.db")
+        config.use_database = "postgresql"
+        config.postgresql_uri = f"sqlite:///{self.path}"
+        config.postgresql_async_uri = f"sqlite+aiosqlite:///{self.path}"
+        super().__init__(config)
+        self.calls = CallCounter()
+
+    def connect(self):
+        if self.engine is not None:
+            return
+        super().connect()
+        Base.metadata.create_all(self.engine)
+        for engine in (self.engine, self.async_engine and self.async_engine.sync_engine):
+            if engine is not None:
+                event.listen(engine, "before_cursor_execute",
+                             lambda *args, **kwargs: self.calls.incr())
+
+
+class _CountingCollection:
+    def __init__(self, collection, calls):
+        self._collection = collection
+        self._calls = calls
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name in MONGO_CALLS:
+            def counted(*args, **kwargs):
+                self._calls.incr()
+                return attr(*args, **kwargs)
+            return counted
+        return attr
+
+
+class _CountingDatabase:
+    def __init__(self, database, calls):
+        self._database = database
+        self._calls = calls
+
+    def __getitem__(self, name):
+        return _CountingCollection(self._database[name], self._calls)
+
+    def __getattr__(self, name):
+        return _CountingCollection(getattr(self._database, name), self._calls)
+
+
+class _CountingClient:
+    def __init__(self, client, calls):
+        self._client = client
+        self._calls = calls
+
+    def __getitem__(self, name):
+        return _CountingDatabase(self._client[name], self._calls)
+
+    def close(self):
+        self._client.close()
+
+
+class MongomockDatabase(Database):
+    def __init__(self, config):
+        config.use_database = "mongodb"
+        config.mongodb_uri = "mongodb://localhost"
+        if config.async_mode:
+            raise ValueError("mongomock has no async stand-in, run the MongoDB harness in sync mode.")
+        super().__init__(config)
+        self.calls = CallCounter()
+
+    def _create_mongo_client(self):
+        import mongomock
+
+        return _CountingClient(mongomock.MongoClient(), self.calls)
+
+
+def create_standin(backend, config):
+    if backend == "sqlite":
+        return SQLiteDatabase(config)
+    elif backend == "mongomock":
+        return MongomockDatabase(config)
+    raise ValueError("Invalid stand-in. Please choose 'sqlite' or 'mongomock'.")
@@ -1,77 +1,273 @@
-from fastapi import FastAPI, Header, Depends, HTTPException
+import time
+_import_started = time.perf_counter()
+
+from contextlib import asynccontextmanager
+import json
+import logging
+from fastapi import APIRouter, FastAPI, Body, Depends, HTTPException, Query, Request, Security, UploadFile
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
-from datetime import timedelta
 from typing import Annotated
-import jwt
-from jwt  import ExpiredSignatureError
-from authentication.auth import Auth, User, UserForm
-from authentication.database import db
-from authentication.postgresql_models import SQLUserDB, invalidate_previous_session
+import orjson
+from authentication.auth import (Auth, User, UserForm, get_auth, get_current_user,
+                                 get_current_user_allow_expired, get_optional_user)
+from authentication.bulk import provision_users, read_users
+from authentication.config import AuthConfig
+from authentication.database import Database
+from authentication.metrics import MetricsMiddleware, StartupTimer, render_prometheus
+from authentication.responses import LogoutResponse, UserPage, UserProfile
+from authentication.schema import SchemaManager
+from authentication.tenants import TenantMiddleware, TenantRegistry
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build the engine / client once per process and release it on shutdown
+    timer, tenants = app.state.startup, app.state.tenants
+    if tenants is not None:
+        # tenants connect on their first request
+        with timer.phase("dummy_hash"):
+            await tenants.start()
+    else:
+        db, auth = app.state.db, app.state.auth
+        with timer.phase("connect"):
+            db.connect()
+        with timer.phase("schema"):
+            app.state.schema.run(db.config.schema_mode)
+        with timer.phase("session_store"):
+            auth.sessions.start()
+        auth.sweeper.start()
+        # so the first unknown-user login is not slower than the rest
+        with timer.phase("dummy_hash"):
+            await auth.get_dummy_hash()
+    logger.info("Started in %.3fs (imports %.3fs): %s", timer.report()["total_seconds"],
+                IMPORT_SECONDS, timer.phases)
+    yield
+    if tenants is not None:
+        await tenants.close()
+    else:
+        await auth.sweeper.stop()
+        await auth.wait_background_tasks()
+        auth.sessions.stop()
+        auth.hasher.shutdown()
+        await db.dispose_async()
+
+
+def create_app(config: AuthConfig = None, db: Database = None,
+               tenants: TenantRegistry = None) -> FastAPI:
+    """Build an application for `config` (or an existing `db`).
 
-app = FastAPI()
-auth = Auth(db)
-AUTH_ACCESS_TOKEN_EXPIRE_MINUTES = 5
+    Only the selected backend's modules are imported here, connections are
+    opened by the lifespan. Each application has its own `Auth`, so several
+    can live in one process. With `tenants` (or `tenants_file` set) every
+    request is served by its tenant's `Auth` instead, see `TenantRegistry`.
+    """
+    timer = StartupTimer()
+    with timer.phase("config"):
+        config = db.config if db else config or AuthConfig()
+        if tenants is None and config.tenants_file:
+            tenants = TenantRegistry.from_config(config)
+        if tenants is None:
+            db = db or Database(config)
+    # bodies are validated against the route's response model, then dumped by orjson
+    app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+    app.state.startup = timer
+    app.state.tenants = tenants
+    app.include_router(router)
+    if tenants is not None:
+        app.add_middleware(TenantMiddleware, tenants=tenants)
+        app.add_middleware(MetricsMiddleware, metrics=tenants.metrics)
+        return app
+    with timer.phase("auth"):
+        auth = Auth(db)
+    app.state.db = db
+    app.state.auth = auth
+    app.state.schema = SchemaManager(db)
+    app.add_middleware(MetricsMiddleware, metrics=db.metrics)
+    return app
 
 
-@app.post("/login")
-async def login(form_data: Annotated[OAuth2PasswordRequestForm, Depends()]):
-    return auth.login(form_data)
+router = APIRouter()
+AuthDep = Annotated[Auth, Depends(get_auth)]
 
-@app.post("/signup")
-async def signup(form_data: Annotated[UserForm, Depends()]):
-    print(form_data)
-    return auth.create_user(form_data)
 
-@app.post("/logout/{username}")
-async def logout(current_user: User = Depends(auth.get_current_user)):
+@router.post("/login")
+async def login(request: Request, form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
+                auth: AuthDep):
+    client_ip = request.client.host if request.client else None
+    return await auth.login(form_data, client_ip)
+
+@router.post("/signup", response_model=UserProfile)
+async def signup(form_data: Annotated[UserForm, Depends()], auth: AuthDep,
+                 current_user: User = Depends(get_optional_user)):
+    # Open to anyone as a plain "user", `role` and `is_superuser` are only
+    # honoured for a caller with the users:roles scope
+    return await auth.create_user(form_data, current_user)
+
+@router.post("/signup/bulk")
+async def bulk_signup(file: UploadFile, auth: AuthDep, format: str = None,
+                      current_user: User = Security(get_current_user, scopes=["users:create"])):
+    # Upload CSV (username,password[,is_superuser]) or NDJSON, progress is
+    # streamed back as one JSON line per chunk.
+    if format is None:
+        filename = file.filename or ""
+        format = "ndjson" if filename.endswith((".ndjson", ".jsonl")) else "csv"
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="Invalid format. Please choose 'csv' or 'ndjson'.")
+
+    # creating superusers takes the same scope as granting the role
+    allow_superusers = auth.has_scopes(current_user, ["users:roles"])
+
+    async def report():
+        chunk_size = auth.db.config.bulk_chunk_size
+        rows = read_users(file.file, format, chunk_size)
+        async for progress in provision_users(auth, rows, chunk_size, allow_superusers):
+            yield json.dumps(progress) + "\n"
+    return StreamingResponse(report(), media_type="application/x-ndjson")
+
+@router.post("/logout/{username}", response_model=LogoutResponse)
+async def logout(auth: AuthDep, current_user: User = Depends(get_current_user_allow_expired)):
+    # an expired access token can still end its session, a revoked one cannot
     username = current_user.username
-    print(current_user)
     if not username:
         raise HTTPException(status_code=404, detail="User not found")
-    return auth.logout(current_user)
+    return await auth.logout(current_user)
 
-db.config.RAISE_EXPIRED_ERROR = False
 # Function to handle token renewal
-@app.post("/renew-token")
-async def renew_token(temp: bool =  db.config.RAISE_EXPIRED_ERROR, current_user: User = Depends(auth.get_current_user)):
-    # If Allow Multiple Concurrent Logins
-    # Don't invalidate the previous session
-    # If Single Active Session per User
-    # Invalidate the previous session (if any)
-    # invalidate_previous_session(db, current_user.username)
-    # Generate a new access token
-    # db.config.RAISE_EXPIRED_ERROR = False
-    new_token = auth.create_access_token( data={"sub": current_user.username})
-    print(new_token)
-    return {"access_token": new_token, "token_type": "bearer", "message": "Token renewed"}
-
-
-@app.get("/me")
-async def get_user_by_name(current_user: User = Depends(auth.get_current_user)):
-    # print(current_user)
+@router.post("/renew-token")
+async def renew_token(refresh_token: Annotated[str, Body(embed=True)], auth: AuthDep):
+    # Exchange the refresh token from /login for a new access token. The
+    # refresh token is rotated, presenting an already used one again ends
+    # the session.
+    tokens = await auth.refresh(refresh_token)
+    return {**tokens, "message": "Token renewed"}
+
+
+@router.put("/users/{username}/role", response_model=UserProfile)
+async def set_user_role(username: str, role: Annotated[str, Body(embed=True)], auth: AuthDep,
+                        current_user: User = Security(get_current_user, scopes=["users:roles"])):
+    # The user's session is ended, their next login gets the new role's scopes
+    return await auth.set_role(username, role)
+
+
+@router.get("/me", response_model=UserProfile)
+async def get_user_by_name(auth: AuthDep,
+                           current_user: User = Security(get_current_user, scopes=["me"])):
     username = current_user.username.strip()
-    return auth.find_me(username)
+    return await auth.find_me(username)
+
+
+@router.get("/all", response_model=UserPage, response_model_exclude_unset=True)
+async def get_all_users(auth: AuthDep,
+                        limit: Annotated[int, Query(ge=1, le=1000)] = 100,
+                        after: str = None,
+                        fields: str = None,
+                        stream: bool = False,
+                        current_user: User = Security(get_current_user, scopes=["users:read"])):
+    # Keyset pages ordered by id (username on MongoDB): pass the returned
+    # `next` as `after`.
+    # `fields` is a comma separated projection, `stream=true` exports every
+    # user as NDJSON in constant memory.
+    store = auth.store
+    selected = ["id", store.cursor_field] if store.cursor_field != "id" else ["id"]
+    for name in (fields.split(",") if fields else store.list_fields):
+        name = name.strip()
+        if name not in store.list_fields:
+            raise HTTPException(status_code=400, detail=f"Unknown field: {name}")
+        if name not in selected:
+            selected.append(name)
+
+    if stream:
+        async def export():
+            async for user in store.iter_users(selected, batch_size=auth.db.config.export_batch_size):
+                yield orjson.dumps(user, default=str) + b"\n"
+        return StreamingResponse(export(), media_type="application/x-ndjson")
 
+    cursor = store.parse_cursor(after) if after else None
+    users = await store.list_users(selected, limit, cursor)
+    next_cursor = str(users[-1][store.cursor_field]) if len(users) == limit else None
+    return {"users": users, "next": next_cursor}
 
-@app.get("/all")
-async def get_all_users():
-    if db.config.use_database == "postgresql":
-        all_users = db.get_session().query(SQLUserDB).all()
-    elif db.config.use_database == "mongodb":
-        collection = db.get_session().users
-        all_users = list(collection.find({}, {"_id": False, "hashed_password": False}))
-    return all_users
+@router.get("/stats")
+async def get_stats(request: Request, auth: AuthDep,
+                    current_user: User = Security(get_current_user, scopes=["superuser"])):
+    # the requesting tenant's pools and caches, and the registry's counters
+    tenants = request.app.state.tenants
+    schema = request.state.tenant.schema if tenants else request.app.state.schema
+    stats = {"pool": auth.db.pool_stats(),
+             "hashing": auth.hasher.stats(),
+             "session_cache": auth.session_cache.stats(),
+             "login_rate_limit": auth.rate_limiter.stats(),
+             "schema": schema.report(),
+             "startup": {"import_seconds": round(IMPORT_SECONDS, 4),
+                         **request.app.state.startup.report()},
+             "revoked_sessions": auth.sessions.revoked_count(),
+             "sweeper": auth.sweeper.stats()}
+    if tenants is not None:
+        stats["tenants"] = tenants.stats()
+    return stats
 
-@app.get("/", response_model=str)
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics(request: Request, auth: AuthDep):
+    # Prometheus text format
+    pool = auth.db.pool_stats()
+    cache = auth.session_cache.stats()
+    hashing = auth.hasher.stats()
+    sweeper = auth.sweeper.stats()
+    gauges = {}
+    if request.app.state.tenants is not None:
+        tenants = request.app.state.tenants.stats()
+        gauges = {"auth_tenants_active": tenants["active"],
+                  "auth_tenants_created_total": tenants["created"],
+                  "auth_tenants_evicted_total": tenants["evicted"]}
+    return render_prometheus(auth.db.metrics, {**gauges,
+        "auth_db_pool_checked_out": pool.get("checked_out", 0),
+        "auth_db_pool_overflow": pool.get("overflow", 0),
+        "auth_db_pool_checkouts_total": pool["checkouts"],
+        "auth_db_pool_checkout_failures_total": pool["checkout_failures"],
+        "auth_db_pool_wait_seconds_total": pool["wait_seconds_total"],
+        "auth_session_cache_hits_total": cache["hits"],
+        "auth_session_cache_misses_total": cache["misses"],
+        "auth_session_cache_hit_rate": cache["hit_rate"],
+        "auth_session_cache_size": cache["size"],
+        "auth_revoked_sessions": auth.sessions.revoked_count(),
+        "auth_hash_queue_depth": hashing["queue_depth"],
+        "auth_hash_rejected_total": hashing["rejected"],
+        "auth_hash_duration_seconds": hashing["latency_seconds"],
+        "auth_login_throttled_total": auth.rate_limiter.rejected,
+        "auth_sessions_expired_total": sweeper["totals"]["expired_sessions"],
+        "auth_refresh_tokens_swept_total": sweeper["totals"]["deleted_tokens"],
+        "auth_session_sweep_seconds": (sweeper["last"] or {}).get("seconds", 0),
+    })
+
+@router.get("/.well-known/jwks.json")
+async def jwks(auth: AuthDep):
+    # Public keys for verifying our tokens locally, empty for HS* secrets
+    return auth.keys.jwks()
+
+@router.get("/", response_model=str)
 async def index():
     return "This is an open endpoint."
 
-@app.get("/protected", response_model=str)
-async def protected_endpoint(current_user: User = Depends(auth.get_current_user)):
+@router.get("/protected", response_model=str)
+async def protected_endpoint(current_user: User = Depends(get_current_user)):
     return "This is a protected endpoint."
 
-@app.get("/super_protected", response_model=str)
-async def super_protected_endpoint(current_user: User = Depends(auth.get_current_user)):
-    if not current_user.is_superuser:
-        raise HTTPException(status_code=403, detail="Access denied")
+@router.get("/super_protected", response_model=str)
+async def super_protected_endpoint(
+        current_user: User = Security(get_current_user, scopes=["superuser"])):
     return "This is a super-protected endpoint."
+
+
+IMPORT_SECONDS = time.perf_counter() - _import_started
+
+
+def __getattr__(name):
+    # `uvicorn main:app` builds the app on first access, so importing `main`
+    # (as `uvicorn --factory main:create_app` does) creates none
+    if name == "app":
+        globals()["app"] = create_app()
+        return globals()["app"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,23 @@
+# tests/conftest.py
+"""Tests run against the local stand-ins, no database server or Redis needed.
+
+    pip install -r requirements.txt
+    python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+# the app imports `authentication` and `main` as top-level modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "authentication_app"))
+
+from authentication.config import AuthConfig  # noqa: E402
+
+
+@pytest.fixture
+def config():
+    # cheap hashes, and no background sweeper racing the test
+    return AuthConfig(bcrypt_rounds=4, session_sweep_enabled=False,
+                      login_rate_limit_enabled=False)
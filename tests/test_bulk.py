@@ -0,0 +1,59 @@
+# tests/test_bulk.py
+import asyncio
+import io
+import json
+import threading
+
+import httpx
+
+from authentication import bulk
+from benchmarks.standins import create_standin
+
+
+def test_read_users_parses_off_the_event_loop(monkeypatch):
+    threads = set()
+    parse_users = bulk.parse_users
+
+    def recording_parse(fh, fmt):
+        for item in parse_users(fh, fmt):
+            threads.add(threading.current_thread())
+            yield item
+
+    monkeypatch.setattr(bulk, "parse_users", recording_parse)
+    data = b"username,password\n" + b"".join(b"u%d,p\n" % i for i in range(5))
+
+    async def run():
+        return [row async for row in bulk.read_users(io.BytesIO(data), "csv", batch_size=2)]
+
+    rows = asyncio.run(run())
+    assert [line for line, _ in rows] == [2, 3, 4, 5, 6]
+    assert threading.main_thread() not in threads
+
+
+def test_bulk_signup_reports_every_row(config):
+    from main import create_app
+
+    config.bulk_chunk_size = 2
+    app = create_app(db=create_standin("sqlite", config))
+    auth = app.state.auth
+    upload = "username,password,is_superuser\na,p,\nb,p,\na,p,\n,p,\nc,p,true\n"
+
+    async def run():
+        async with app.router.lifespan_context(app):
+            await auth.store.create_user(
+                "admin", await auth.get_password_hash("secret"), False, "admin")
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                response = await client.post(
+                    "/login", data={"username": "admin", "password": "secret"})
+                headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+                response = await client.post(
+                    "/signup/bulk", headers=headers,
+                    files={"file": ("users.csv", upload.encode(), "text/csv")})
+        return [json.loads(line) for line in response.text.splitlines()]
+
+    reports = asyncio.run(run())
+    assert reports[-1]["done"]
+    # an admin cannot create superusers, `c` is invalid like the row without a name
+    assert {key: reports[-1][key] for key in ("processed", "created", "duplicates", "errors")} \
+        == {"processed": 5, "created": 2, "duplicates": 1, "errors": 2}
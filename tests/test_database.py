@@ -0,0 +1,32 @@
+# tests/test_database.py
+import asyncio
+
+import httpx
+from fastapi import Depends
+from sqlalchemy import text
+
+from authentication.auth import get_db
+from benchmarks.standins import create_standin
+
+
+def test_get_db_session_is_closed_after_the_request(config):
+    from main import create_app
+
+    db = create_standin("sqlite", config)
+    app = create_app(db=db)
+
+    @app.get("/test-db")
+    async def read(session=Depends(get_db)):
+        return {"checked_out": db.pool_stats()["checked_out"],
+                "one": session.execute(text("SELECT 1")).scalar()}
+
+    async def run():
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                response = await client.get("/test-db")
+            return response.json(), db.pool_stats()["checked_out"]
+
+    during, after = asyncio.run(run())
+    assert during == {"checked_out": 1, "one": 1}
+    assert after == 0
@@ -0,0 +1,62 @@
+# tests/test_keys.py
+import asyncio
+import os
+import threading
+import time
+
+from authentication.keys import KeyRing
+
+
+def _pem_files(key_dir):
+    return sorted(name for name in os.listdir(key_dir) if name.endswith(".pem"))
+
+
+def _age(key_dir, seconds):
+    for name in _pem_files(key_dir):
+        path = os.path.join(key_dir, name)
+        past = os.path.getmtime(path) - seconds
+        os.utime(path, (past, past))
+
+
+def test_replaced_key_is_deleted_after_its_window(tmp_path):
+    key_dir = str(tmp_path)
+    ring = KeyRing("ES256", key_dir=key_dir, retire_after_seconds=3600)
+    old_kid = ring.signing_key().kid
+    new_kid = ring.rotate(force=True).kid
+    # still inside the window: both verify, both files stay
+    assert ring.verification_key(old_kid) is not None
+    assert len(_pem_files(key_dir)) == 2
+
+    _age(key_dir, 7200)
+    later = KeyRing("ES256", key_dir=key_dir, retire_after_seconds=3600)
+
+    assert _pem_files(key_dir) == [new_kid + ".pem"]
+    assert later.verification_key(old_kid) is None
+    assert [key["kid"] for key in later.jwks()["keys"]] == [new_kid]
+
+
+def test_async_callers_rotate_and_reload_on_the_threadpool(tmp_path, monkeypatch):
+    key_dir = str(tmp_path)
+    ring = KeyRing("ES256", key_dir=key_dir, rotation_hours=1)
+    other = KeyRing("ES256", key_dir=key_dir, rotation_hours=1)
+    threads = []
+    for name in ("rotate", "_load"):
+        original = getattr(KeyRing, name)
+
+        def recording(self, *args, original=original, **kwargs):
+            threads.append(threading.current_thread())
+            return original(self, *args, **kwargs)
+        monkeypatch.setattr(KeyRing, name, recording)
+
+    _age(key_dir, 7200)
+    ring._current.created_at = time.time() - 7200
+
+    async def run():
+        await ring.ensure_signing_key()
+        new_kid = ring.signing_key().kid
+        await other.ensure_verification_key(new_kid)
+        return new_kid
+
+    new_kid = asyncio.run(run())
+    assert other.verification_key(new_kid) is not None
+    assert threads and threading.main_thread() not in threads
@@ -0,0 +1,72 @@
+# tests/test_list_users.py
+import asyncio
+import uuid
+from datetime import datetime
+
+import httpx
+from bson import ObjectId
+
+from authentication.mongo_stores import MongoUserStore
+from benchmarks.standins import create_standin
+
+
+def _user_doc(_id, username):
+    return {"_id": _id, "username": username, "hashed_password": "x", "is_superuser": False,
+            "sessions": [], "session_id": "", "status": "not active",
+            "created_at": datetime.utcnow(), "role": "user"}
+
+
+def _mixed_id_users(db):
+    # ObjectId `_id`s as MongoDB assigns them, UUIDs as some earlier versions wrote them
+    users = db.get_session().users
+    users.insert_many([_user_doc(ObjectId(), f"legacy{i}") for i in range(5)])
+    users.insert_many([_user_doc(uuid.uuid4(), f"new{i}") for i in range(5)])
+    return sorted([f"legacy{i}" for i in range(5)] + [f"new{i}" for i in range(5)])
+
+
+def test_mongo_pages_cover_mixed_id_types(config):
+    db = create_standin("mongomock", config)
+    db.connect()
+    expected = _mixed_id_users(db)
+    store = MongoUserStore(db)
+
+    async def page_all():
+        seen, after = [], None
+        while True:
+            users = await store.list_users(["id", "username"], 3, after)
+            seen += [user["username"] for user in users]
+            if len(users) < 3:
+                return seen
+            after = store.parse_cursor(users[-1][store.cursor_field])
+
+    assert asyncio.run(page_all()) == expected
+
+
+def test_all_endpoint_follows_next_on_mongo(config):
+    from main import create_app
+
+    db = create_standin("mongomock", config)
+    app = create_app(db=db)
+
+    async def page_all():
+        transport = httpx.ASGITransport(app=app)
+        async with app.router.lifespan_context(app):
+            expected = _mixed_id_users(db)
+            auth = app.state.auth
+            await auth.store.create_user(
+                "admin", await auth.get_password_hash("secret"), False, "admin")
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                response = await client.post("/login", data={"username": "admin", "password": "secret"})
+                headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+                seen, params = [], {"limit": 3, "fields": "status"}
+                while True:
+                    response = await client.get("/all", params=params, headers=headers)
+                    assert response.status_code == 200
+                    page = response.json()
+                    seen += [user["username"] for user in page["users"]]
+                    if page["next"] is None:
+                        return seen, expected
+                    params["after"] = page["next"]
+
+    seen, expected = asyncio.run(page_all())
+    assert seen == sorted(expected + ["admin"])
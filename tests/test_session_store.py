@@ -0,0 +1,80 @@
+# tests/test_session_store.py
+import asyncio
+import time
+
+import pytest
+
+from authentication.session_store import RedisSessionStore
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+@pytest.fixture
+def server():
+    # one Redis shared by every "worker" of a test
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def workers(server):
+    started = []
+
+    def start(count=1):
+        stores = [RedisSessionStore(fakeredis.FakeRedis(server=server)) for _ in range(count)]
+        for store in stores:
+            store.start()
+        started.extend(stores)
+        return stores
+
+    yield start
+    for store in started:
+        store.stop()
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_revocation_reaches_other_workers(workers):
+    first, second = workers(2)
+    events = []
+    first.subscribe(events.append)
+    second.subscribe(events.append)
+
+    asyncio.run(first.publish_revocation("alice", "sid-1"))
+
+    assert first.is_revoked("alice")
+    assert wait_for(lambda: second.is_revoked("alice"))
+    # subscribers only hear about other workers' events
+    assert wait_for(lambda: len(events) == 1)
+    assert events[0]["type"] == "revoke" and events[0]["session_id"] == "sid-1"
+
+
+def test_activation_clears_the_revocation_everywhere(workers, server):
+    first, second = workers(2)
+    asyncio.run(first.publish_revocation("alice"))
+    assert wait_for(lambda: second.is_revoked("alice"))
+
+    asyncio.run(second.publish_activation("alice", "sid-2"))
+
+    assert not second.is_revoked("alice")
+    assert wait_for(lambda: not first.is_revoked("alice"))
+    assert not fakeredis.FakeRedis(server=server).exists("auth:revoked:alice")
+
+
+def test_late_worker_loads_current_revocations(workers, server):
+    (first,) = workers()
+    asyncio.run(first.publish_revocation("alice"))
+    asyncio.run(first.publish_revocation("bob"))
+    asyncio.run(first.publish_activation("bob"))
+
+    (late,) = workers()
+
+    assert late.is_revoked("alice")
+    assert not late.is_revoked("bob")
+    assert late.revoked_count() == 1
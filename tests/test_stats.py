@@ -0,0 +1,31 @@
+# tests/test_stats.py
+import asyncio
+
+import httpx
+
+from benchmarks.standins import create_standin
+
+
+def test_stats_needs_the_superuser_scope(config):
+    from main import create_app
+
+    app = create_app(db=create_standin("sqlite", config))
+    auth = app.state.auth
+
+    async def run():
+        statuses = {}
+        async with app.router.lifespan_context(app):
+            for username, role in (("plain", "user"), ("root", "superuser")):
+                await auth.store.create_user(
+                    username, await auth.get_password_hash("secret"), role == "superuser", role)
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                statuses["anonymous"] = (await client.get("/stats")).status_code
+                for username in ("plain", "root"):
+                    response = await client.post(
+                        "/login", data={"username": username, "password": "secret"})
+                    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+                    statuses[username] = (await client.get("/stats", headers=headers)).status_code
+        return statuses
+
+    assert asyncio.run(run()) == {"anonymous": 401, "plain": 403, "root": 200}
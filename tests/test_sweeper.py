@@ -0,0 +1,30 @@
+# tests/test_sweeper.py
+import asyncio
+
+import pytest
+
+from benchmarks.standins import create_standin
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "mongomock"])
+def test_first_sweep_ends_sessions_without_refresh_tokens(config, backend):
+    from main import create_app
+
+    app = create_app(db=create_standin(backend, config))
+    auth = app.state.auth
+
+    async def run():
+        async with app.router.lifespan_context(app):
+            await auth.store.create_user("legacy", "x", False)
+            # active from before refresh tokens were stored
+            assert await auth.store.activate_session("legacy", "old-sid")
+            first = await auth.sweeper.sweep()
+
+            # ended, so it can start a session again, which later sweeps leave alone
+            assert await auth.store.activate_session("legacy", "new-sid")
+            second = await auth.sweeper.sweep()
+            return first, second
+
+    first, second = asyncio.run(run())
+    assert first["expired_sessions"] == 1
+    assert second["expired_sessions"] == 0